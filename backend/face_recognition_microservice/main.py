@@ -3,12 +3,14 @@ import uuid
 import shutil
 import logging
 import subprocess
+import threading
 import face_recognition
 import cv2
 import numpy as np
 import requests
 from typing import List, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import repeat
 import sys
 
 # Add backend directory to sys.path to import gcs_service
@@ -20,12 +22,21 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Temporary Storage ---
-TEMP_STORAGE_PATH = "./temp_storage"
+# Downloaded videos and photos land here; set TEMP_STORAGE_PATH to a tmpfs mount to keep them in RAM
+TEMP_STORAGE_PATH = os.environ.get("TEMP_STORAGE_PATH", "./temp_storage")
 os.makedirs(TEMP_STORAGE_PATH, exist_ok=True)
 
+# Read size for downloads; 1 MiB chunks avoid thousands of small writes per video
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Upper bound on cast photos downloaded at once
+PHOTO_DOWNLOAD_MAX_WORKERS = 8
+
 # --- Helper Functions ---
-def download_file_from_gcs(gcs_bucket: str, gcs_blob_name: str, local_path: str):
-    """Downloads a file from a GCS signed URL to a local path."""
+def download_file_from_gcs(gcs_bucket: str, gcs_blob_name: str, local_path: str, stop_event: threading.Event = None):
+    """
+    Downloads a file from a GCS signed URL to a local path.
+    If `stop_event` is set, the download is abandoned at the next chunk.
+    """
     try:
         signed_url, error = gcs_service.generate_signed_url(gcs_bucket, gcs_blob_name)
         if error:
@@ -34,7 +45,10 @@ def download_file_from_gcs(gcs_bucket: str, gcs_blob_name: str, local_path: str)
         response = requests.get(signed_url, stream=True)
         response.raise_for_status()
         with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if stop_event is not None and stop_event.is_set():
+                    logger.info(f"Stopped downloading gs://{gcs_bucket}/{gcs_blob_name}")
+                    return
                 f.write(chunk)
         logger.info(f"Successfully downloaded gs://{gcs_bucket}/{gcs_blob_name}")
     except (requests.exceptions.RequestException, Exception) as e:
@@ -159,22 +173,32 @@ def run_face_recognition_job(job_id: str, gcs_bucket: str, gcs_video_uri: str, g
     logger.info(f"[{job_id}] Starting job for video {gcs_video_uri}")
 
     try:
-        # Download video
+        # The video download runs in the background while the cast photos are
+        # downloaded and encoded, so the two stages overlap instead of adding up
         local_video_path = os.path.join(job_temp_dir, os.path.basename(gcs_video_uri))
-        download_file_from_gcs(gcs_bucket, gcs_video_uri, local_video_path)
-
-        # Download all cast photos
-        local_photo_paths = []
-        for photo_uri in gcs_cast_photo_uris:
-            clean_photo_uri = photo_uri.replace(f"gs://{gcs_bucket}/", "")
-            local_photo_path = os.path.join(job_temp_dir, os.path.basename(clean_photo_uri))
-            download_file_from_gcs(gcs_bucket, clean_photo_uri, local_photo_path)
-            local_photo_paths.append(local_photo_path)
-        
-        known_encodings, _ = load_known_faces(local_photo_paths)
-        if not known_encodings:
-            logger.error(f"[{job_id}] No valid faces found in the provided photos. Exiting.")
-            return
+        video_executor = ThreadPoolExecutor(max_workers=1)
+        stop_video_download = threading.Event()
+        video_download = video_executor.submit(
+            download_file_from_gcs, gcs_bucket, gcs_video_uri, local_video_path, stop_video_download
+        )
+        try:
+            # Download all cast photos concurrently; a photo listed more than once is fetched and encoded once
+            photo_blob_names = [uri.replace(f"gs://{gcs_bucket}/", "") for uri in dict.fromkeys(gcs_cast_photo_uris)]
+            local_photo_paths = [os.path.join(job_temp_dir, os.path.basename(name)) for name in photo_blob_names]
+            with ThreadPoolExecutor(max_workers=PHOTO_DOWNLOAD_MAX_WORKERS) as executor:
+                list(executor.map(download_file_from_gcs, repeat(gcs_bucket), photo_blob_names, local_photo_paths))
+
+            known_encodings, _ = load_known_faces(local_photo_paths)
+            if not known_encodings:
+                logger.error(f"[{job_id}] No valid faces found in the provided photos. Exiting.")
+                return
+
+            video_download.result()
+        finally:
+            # When the job ends before the video is needed, the download is stopped at its
+            # next chunk and not waited for; after a completed download this does nothing
+            stop_video_download.set()
+            video_executor.shutdown(wait=False, cancel_futures=True)
 
         face_found = find_scenes_with_any_face(local_video_path, known_encodings)
         
@@ -204,8 +228,10 @@ def run_face_recognition_job(job_id: str, gcs_bucket: str, gcs_video_uri: str, g
         raise e # Re-raise the exception to mark the Cloud Run Job as failed
     
     finally:
-        if os.path.exists(job_temp_dir):
+        try:
             shutil.rmtree(job_temp_dir)
+        except FileNotFoundError:
+            pass
 
 if __name__ == "__main__":
     # Get parameters from environment variables
@@ -1,13 +1,29 @@
 import os
 import google
 from google.cloud import storage
-from typing import List, Tuple
+from google.oauth2 import service_account
+from google.api_core.exceptions import NotFound
+from typing import Dict, List, Tuple
 import datetime
 import logging
-import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# Upper bound on the number of files returned by a single listing. The UI cannot
+# usefully present more than this, so iteration stops once it is reached.
+MAX_LIST_RESULTS = int(os.environ.get("GCS_MAX_LIST_RESULTS", 2000))
+
+# The JSON API accepts at most 100 calls in a single batch request
+MAX_BATCH_REQUESTS = 100
+
+# A compose request joins at most 32 source objects
+MAX_COMPOSE_COMPONENTS = 32
 
 # --- Centralized GCS Client Initialization ---
 _storage_client = None
+# Endpoints and background tasks call this from worker threads; the lock makes
+# sure concurrent first calls still build a single client
+_storage_client_lock = threading.Lock()
 
 
 def get_storage_client() -> storage.Client:
@@ -17,14 +33,16 @@ def get_storage_client() -> storage.Client:
     """
     global _storage_client
     if _storage_client is None:
-        credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-        try:
-            if credentials_path:
-                _storage_client = storage.Client.from_service_account_json(credentials_path)
-            else:
-                _storage_client = storage.Client()
-        except Exception as e:
-            raise IOError(f"Failed to initialize GCS client: {e}") from e
+        with _storage_client_lock:
+            if _storage_client is None:
+                credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+                try:
+                    if credentials_path:
+                        _storage_client = storage.Client.from_service_account_json(credentials_path)
+                    else:
+                        _storage_client = storage.Client()
+                except Exception as e:
+                    raise IOError(f"Failed to initialize GCS client: {e}") from e
 
     return _storage_client
 
@@ -41,7 +59,8 @@ def ensure_gcs_folder_exists(bucket_name: str, folder_name: str) -> Tuple[bool,
     try:
         storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
-        blobs = list(bucket.list_blobs(prefix=folder_name, max_results=1))
+        # Only the presence of a name matters here, so request just that field
+        blobs = list(bucket.list_blobs(prefix=folder_name, max_results=1, fields="items(name)"))
         if not blobs:
             placeholder_blob_name = f"{folder_name}.gcs_folder_placeholder"
             blob = bucket.blob(placeholder_blob_name)
@@ -54,9 +73,12 @@ def ensure_gcs_folder_exists(bucket_name: str, folder_name: str) -> Tuple[bool,
         return False, error_msg
 
 
-def list_gcs_files(bucket_name: str, prefix: str = "", allowed_extensions: List[str] = None) -> Tuple[List[str], str]:
+def list_gcs_files(
+    bucket_name: str, prefix: str = "", allowed_extensions: List[str] = None, max_results: int = MAX_LIST_RESULTS
+) -> Tuple[List[str], str]:
     """
     Lists files in a GCS bucket with a given prefix and optional extension filtering.
+    At most `max_results` file names are returned.
     """
     files = []
     if prefix and not prefix.endswith("/"):
@@ -69,29 +91,47 @@ def list_gcs_files(bucket_name: str, prefix: str = "", allowed_extensions: List[
 
     try:
         bucket = storage_client.bucket(bucket_name)
-        if not bucket.exists():
-            return [], f"Bucket '{bucket_name}' does not exist or you don't have access."
 
-        folder_exists, folder_error = ensure_gcs_folder_exists(bucket_name, prefix)
-        if not folder_exists:
-            return [], folder_error
+        # str.endswith accepts a tuple, so each name is checked against all extensions in one call
+        extension_suffixes = tuple(ext.lower() for ext in allowed_extensions) if allowed_extensions else None
 
-        blobs = bucket.list_blobs(prefix=prefix)
+        # The listing itself reports a missing bucket and shows whether the folder
+        # exists, so no separate existence checks are made before it
+        folder_seen = False
+        # Only names are needed, so ask GCS for just that field in full-size pages
+        blobs = bucket.list_blobs(prefix=prefix, page_size=1000, fields="items(name),nextPageToken")
         for blob in blobs:
+            folder_seen = True
             if blob.name == f"{prefix}.gcs_folder_placeholder" or blob.name.endswith("/"):
                 continue
 
-            if allowed_extensions:
-                if any(blob.name.lower().endswith(ext) for ext in allowed_extensions):
+            if extension_suffixes:
+                if blob.name.lower().endswith(extension_suffixes):
                     files.append(blob.name)
             else:
                 files.append(blob.name)
 
+            # One file past the limit is read, so only a listing that really has more
+            # files than `max_results` is reported as truncated
+            if len(files) > max_results:
+                files.pop()
+                logging.warning(f"Listing of gs://{bucket_name}/{prefix} truncated at {max_results} files.")
+                break
+
+        if prefix and not folder_seen:
+            folder_exists, folder_error = ensure_gcs_folder_exists(bucket_name, prefix)
+            if not folder_exists:
+                return [], folder_error
+
         display_location = f"folder '{prefix}' in bucket '{bucket_name}'" if prefix else f"bucket '{bucket_name}'"
         if not files:
             return [], f"No files found in {display_location}."
 
-        return sorted(files), ""
+        # GCS lists names in lexicographic order and the filter above keeps that
+        # order, so the result needs no extra sort
+        return files, ""
+    except NotFound:
+        return [], f"Bucket '{bucket_name}' does not exist or you don't have access."
     except Exception as e:
         logging.error(f"GCS LISTING DEBUG: An exception occurred in list_gcs_files for bucket='{bucket_name}' and prefix='{prefix}'.")
         logging.error(f"GCS LISTING DEBUG: Exception type: {type(e).__name__}")
@@ -122,6 +162,20 @@ def download_gcs_blob(bucket_name: str, source_blob_name: str, destination_file_
         return False, error_msg
 
 
+def download_gcs_blob_as_bytes(bucket_name: str, source_blob_name: str) -> Tuple[bytes, str]:
+    """
+    Downloads a small blob (e.g. a metadata file) into memory without touching local disk.
+    """
+    try:
+        storage_client = get_storage_client()
+        blob = storage_client.bucket(bucket_name).blob(source_blob_name)
+        return blob.download_as_bytes(), ""
+    except Exception as e:
+        error_msg = f"Error downloading GCS blob gs://{bucket_name}/{source_blob_name}: {e}"
+        logging.error(error_msg)
+        return b"", error_msg
+
+
 # def upload_gcs_blob(bucket_name: str, source_file_name: str, destination_blob_name: str) -> Tuple[bool, str]:
 #     """
 #     Uploads a file to the bucket.
@@ -142,7 +196,8 @@ def _upload_part(bucket_name: str, blob_name: str, source_file: str, start: int,
     """
     Uploads a chunk of the file as a temporary part blob.
     """
-    storage_client = storage.Client()
+    # Runs in a worker thread, so the process-wide client and its connection pool are shared
+    storage_client = get_storage_client()
     bucket = storage_client.bucket(bucket_name)
     part_blob_name = f"{blob_name}.part{part_number}"
     blob = bucket.blob(part_blob_name)
@@ -158,42 +213,49 @@ def _upload_part(bucket_name: str, blob_name: str, source_file: str, start: int,
 def upload_gcs_blob(bucket_name: str, source_file_name: str, destination_blob_name: str, chunk_size: int = 50 * 1024 * 1024) -> Tuple[bool, str]:
     """
     Uploads a file to a GCS bucket using concurrent chunked uploads for performance.
+    Files no larger than `chunk_size` are uploaded in a single request instead.
     - Splits file into parts
     - Uploads them in parallel
     - Composes them back into a single blob
     - Cleans up temporary part blobs
     """
     try:
-        storage_client = storage.Client()
+        storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
         file_size = os.path.getsize(source_file_name)
 
-        # Worker count: half CPUs, between 2 and 8
-        num_workers = max(2, min(8, multiprocessing.cpu_count() // 2))
-        pool = multiprocessing.Pool(num_workers)
+        # A file that fits in one part is uploaded directly; splitting it would only add
+        # a compose call and a part deletion on top of the same upload
+        if file_size <= chunk_size:
+            bucket.blob(destination_blob_name).upload_from_filename(source_file_name)
+            return True, ""
 
-        # Schedule parallel part uploads
-        tasks = []
-        part_number = 0
-        for start in range(0, file_size, chunk_size):
-            end = min(start + chunk_size, file_size)
-            tasks.append(pool.apply_async(_upload_part, (bucket_name, destination_blob_name, source_file_name, start, end, part_number)))
-            part_number += 1
+        # Parts are grown if needed so a single compose call can join all of them
+        chunk_size = max(chunk_size, -(-file_size // MAX_COMPOSE_COMPONENTS))
 
-        pool.close()
-        pool.join()
+        # Worker count: half CPUs, between 2 and 8
+        num_workers = max(2, min(8, (os.cpu_count() or 2) // 2))
+
+        # Part uploads are network bound, so threads sharing one client are enough;
+        # no worker processes or per-part clients have to be started
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            tasks = [
+                executor.submit(_upload_part, bucket_name, destination_blob_name, source_file_name, start, min(start + chunk_size, file_size), part_number)
+                for part_number, start in enumerate(range(0, file_size, chunk_size))
+            ]
 
         # Collect uploaded part blob names
-        part_blob_names = [task.get() for task in tasks]
+        part_blob_names = [task.result() for task in tasks]
         part_blobs = [bucket.blob(name) for name in part_blob_names]
 
         # Compose parts into final blob
         final_blob = bucket.blob(destination_blob_name)
         final_blob.compose(part_blobs)
 
-        # Clean up temporary part blobs
-        for pb in part_blobs:
-            pb.delete()
+        # Clean up temporary part blobs in a single batch request
+        with storage_client.batch(raise_exception=False):
+            for pb in part_blobs:
+                pb.delete()
 
         return True, ""
     except Exception as e:
@@ -202,7 +264,9 @@ def upload_gcs_blob(bucket_name: str, source_file_name: str, destination_blob_na
         return False, error_msg
 
 
-def upload_gcs_blob_from_stream(bucket_name: str, source_stream, destination_blob_name: str) -> Tuple[bool, str]:
+def upload_gcs_blob_from_stream(
+    bucket_name: str, source_stream, destination_blob_name: str, content_type: str = None
+) -> Tuple[bool, str]:
     """
     Uploads a file-like object (stream) to a GCS bucket.
     """
@@ -214,7 +278,7 @@ def upload_gcs_blob_from_stream(bucket_name: str, source_stream, destination_blo
         # Rewind the stream to the beginning before uploading
         source_stream.seek(0)
         
-        blob.upload_from_file(source_stream)
+        blob.upload_from_file(source_stream, content_type=content_type)
 
         return True, ""
     except Exception as e:
@@ -233,38 +297,84 @@ def delete_gcs_blob(bucket_name: str, blob_name: str) -> Tuple[bool, str]:
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
 
-        if not blob.exists():
-            return False, f"Blob gs://{bucket_name}/{blob_name} not found."
-
+        # Deleting directly saves an exists() round-trip; a missing blob raises NotFound
         blob.delete()
         return True, ""
+    except NotFound:
+        return False, f"Blob gs://{bucket_name}/{blob_name} not found."
     except Exception as e:
         error_msg = f"Error deleting GCS blob gs://{bucket_name}/{blob_name}: {e}"
         logging.error(error_msg)
         return False, error_msg
 
 
-def delete_gcs_blobs_batch(bucket_name: str, blob_names: List[str]) -> Tuple[bool, str]:
+def delete_gcs_blobs_batch(bucket_name: str, blob_names: List[str]) -> Tuple[List[str], Dict[str, str]]:
     """
-    Deletes multiple blobs from the bucket in a single batch request.
+    Deletes multiple blobs from the bucket using batch requests of up to
+    MAX_BATCH_REQUESTS deletions each. Blobs that no longer exist count as deleted.
+    Returns a tuple of (deleted_blob_names, {blob_name: error_message} for failures).
     """
+    deleted, failed = [], {}
     try:
         storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
-
-        with storage_client.batch():
-            for blob_name in blob_names:
-                blob = bucket.blob(blob_name)
-                if blob.exists():
-                    blob.delete()
-                    logging.info(f"Successfully deleted blob gs://{bucket_name}/{blob_name} in batch.")
-                else:
-                    logging.warning(f"Blob gs://{bucket_name}/{blob_name} not found, skipping deletion.")
-        return True, ""
     except Exception as e:
         error_msg = f"Error during batch deletion from GCS bucket gs://{bucket_name}/: {e}"
         logging.error(error_msg)
-        return False, error_msg
+        return [], dict.fromkeys(blob_names, error_msg)
+
+    for start in range(0, len(blob_names), MAX_BATCH_REQUESTS):
+        chunk = blob_names[start : start + MAX_BATCH_REQUESTS]
+        try:
+            # Calls inside a batch are deferred, so an exists() check here could not
+            # skip anything; each sub-request's own response is inspected instead.
+            batch = storage_client.batch(raise_exception=False)
+            with batch:
+                for blob_name in chunk:
+                    bucket.delete_blob(blob_name)
+        except Exception as e:
+            error_msg = f"Error during batch deletion from GCS bucket gs://{bucket_name}/: {e}"
+            logging.error(error_msg)
+            failed.update(dict.fromkeys(chunk, error_msg))
+            continue
+
+        # Sub-responses come back in request order; a 404 means the blob is already gone.
+        # Batch has no public accessor for them: delete_blob returns nothing inside a batch,
+        # and __exit__ drops the list finish() returns. _responses is what finish() stores in
+        # google-cloud-storage 3.3.0, which requirements.txt pins; recheck it before upgrading.
+        for blob_name, response in zip(chunk, batch._responses):
+            if 200 <= response.status_code < 300 or response.status_code == 404:
+                deleted.append(blob_name)
+            else:
+                failed[blob_name] = f"HTTP {response.status_code}: {response.text}"
+                logging.error(f"Failed to delete gs://{bucket_name}/{blob_name}: {failed[blob_name]}")
+        logging.info(f"Batch deleted {len(chunk)} blob(s) from gs://{bucket_name}/.")
+    return deleted, failed
+
+
+_signing_credentials = None
+_signing_credentials_lock = threading.Lock()
+
+
+def _get_signing_credentials():
+    """
+    Returns credentials for signing URLs, loaded once per process.
+    Default credentials are only refreshed once their access token has expired.
+    """
+    global _signing_credentials
+    with _signing_credentials_lock:
+        if _signing_credentials is None:
+            credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+            if credentials_path:
+                _signing_credentials = service_account.Credentials.from_service_account_file(
+                    credentials_path,
+                    scopes=['https://www.googleapis.com/auth/cloud-platform']
+                )
+            else:
+                _signing_credentials, _ = google.auth.default()
+        if not isinstance(_signing_credentials, service_account.Credentials) and not _signing_credentials.valid:
+            _signing_credentials.refresh(google.auth.transport.requests.Request())
+        return _signing_credentials
 
 
 def generate_signed_url(
@@ -274,19 +384,7 @@ def generate_signed_url(
     Generates a signed URL for a GCS blob for GET (download) or PUT (upload).
     """
     try:
-        # Load service account credentials directly
-        credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-        if credentials_path:
-            from google.oauth2 import service_account
-            credentials = service_account.Credentials.from_service_account_file(
-                credentials_path,
-                scopes=['https://www.googleapis.com/auth/cloud-platform']
-            )
-        else:
-            # Use the centralized client which should be initialized with a service account
-            credentials, project_id = google.auth.default()
-            credentials.refresh(google.auth.transport.requests.Request())
-        
+        credentials = _get_signing_credentials()
         storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
@@ -294,14 +392,22 @@ def generate_signed_url(
         # URL is valid for 1 hour
         expiration_time = datetime.timedelta(hours=1)
 
+        if isinstance(credentials, service_account.Credentials):
+            # Sign locally with the key file instead of through the IAM signBlob API
+            signing_kwargs = {"credentials": credentials}
+        else:
+            signing_kwargs = {
+                "service_account_email": credentials.service_account_email,
+                "access_token": credentials.token,
+            }
+
         # Generate the signed URL
         signed_url = blob.generate_signed_url(
             version="v4",
             expiration=expiration_time,
             method=method,
             content_type=content_type,
-            service_account_email=credentials.service_account_email,
-            access_token=credentials.token,
+            **signing_kwargs,
         )
         return signed_url, ""
     except Exception as e:
@@ -317,18 +423,20 @@ def list_workspaces(bucket_name: str) -> Tuple[List[str], str]:
     try:
         storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
-        if not bucket.exists():
-            return [], f"Bucket '{bucket_name}' does not exist or you don't have access."
 
-        # Use a delimiter to find top-level "directories"
-        iterator = bucket.list_blobs(delimiter="/")
-        # The prefixes property of the iterator's pages contains the "folder" names
-        workspaces = [prefix for page in iterator.pages for prefix in page.prefixes]
+        # Use a delimiter so GCS returns the top-level "directories" itself
+        # Only the folder prefixes are used, so the top-level blob entries are left out of the response
+        iterator = bucket.list_blobs(delimiter="/", fields="prefixes,nextPageToken")
+        # Draining the iterator fills its prefixes set with the "folder" names
+        for _ in iterator:
+            pass
 
         # Clean up the names (remove trailing slash)
-        workspaces = [w.strip("/") for w in workspaces]
+        workspaces = [w.strip("/") for w in iterator.prefixes]
 
         return sorted(workspaces), ""
+    except NotFound:
+        return [], f"Bucket '{bucket_name}' does not exist or you don't have access."
     except Exception as e:
         error_message = f"Error listing workspaces in gs://{bucket_name}/: {e}"
         logging.error(f"GCS Error: {error_message}")
@@ -377,11 +485,11 @@ def copy_gcs_blob(
         source_blob = source_bucket.blob(source_blob_name)
         destination_bucket = storage_client.bucket(destination_bucket_name)
 
-        if not source_blob.exists():
-            return False, f"Source blob gs://{source_bucket_name}/{source_blob_name} not found."
-
+        # Copying directly saves an exists() round-trip; a missing source raises NotFound
         source_bucket.copy_blob(source_blob, destination_bucket, destination_blob_name)
         return True, ""
+    except NotFound:
+        return False, f"Source blob gs://{source_bucket_name}/{source_blob_name} not found."
     except Exception as e:
         error_msg = f"Error copying GCS blob from gs://{source_bucket_name}/{source_blob_name} to gs://{destination_bucket_name}/{destination_blob_name}: {e}"
         logging.error(error_msg)
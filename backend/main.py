@@ -1,16 +1,22 @@
-import json
 import os
 import uuid
 import shutil
 import logging
 
+import zlib
+
 from datetime import datetime, timezone
+from typing import Callable
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Form, UploadFile, Query, File
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Form, UploadFile, Query, File, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from google.api_core.exceptions import NotFound
 
 # Import schemas
 from schemas import (
+    JobStatus,
     UploadURLRequest,
     UploadURLResponse,
     FaceClipGenerationRequest,
@@ -29,16 +35,60 @@ load_dotenv()
 from logging_config import setup_logging
 import gcs_service
 import task_service
+# The job store is shared with the background tasks that write to it
+from task_service import _read_job, _write_job
 
 # Setup logging
 setup_logging()
 
+# --- Request Decompression ---
+# Upper bound on a decompressed request body, so a small gzip payload cannot expand without limit
+MAX_DECOMPRESSED_REQUEST_BYTES = int(os.environ.get("MAX_DECOMPRESSED_REQUEST_BYTES", 32 * 1024 * 1024))
+
+
+class GzipRequest(Request):
+    """Request whose body is transparently decompressed when sent with Content-Encoding: gzip."""
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            if "gzip" in self.headers.getlist("Content-Encoding"):
+                # 16 + MAX_WBITS selects the gzip container; max_length stops inflating at the cap
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                try:
+                    body = decompressor.decompress(body, MAX_DECOMPRESSED_REQUEST_BYTES)
+                except zlib.error as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid gzip request body: {e}")
+                if decompressor.unconsumed_tail:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Decompressed request body exceeds {MAX_DECOMPRESSED_REQUEST_BYTES} bytes.",
+                    )
+            self._body = body
+        return self._body
+
+
+class GzipRoute(APIRoute):
+    """Route class that lets JSON endpoints accept gzip-compressed request bodies."""
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            request = GzipRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return custom_route_handler
+
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="Rev-Med Video Processing API",
     description="An API for splitting, analyzing, and processing video files.",
     version="1.0.0",
 )
+# Must be set before any route is declared
+app.router.route_class = GzipRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -49,49 +99,30 @@ app.add_middleware(
     expose_headers=["Access-Control-Allow-Private-Network"],
 )
 
-# --- File-based Job Store ---
-JOB_STORE_PATH = "./job_store"
-os.makedirs(JOB_STORE_PATH, exist_ok=True)
-
-
-def _get_job_path(job_id: str) -> str:
-    return os.path.join(JOB_STORE_PATH, f"{job_id}.json")
-
-
-def _read_job(job_id: str) -> dict:
-    job_path = _get_job_path(job_id)
-    if not os.path.exists(job_path):
-        return None
-    try:
-        with open(job_path, "r") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                # If the file is empty or malformed, return None
-                return None
-        return data
-    except (IOError, json.JSONDecodeError):
-        # Return None if the file is locked or empty, allowing the client to retry
-        return None
-
-
-def _write_job(job_id: str, job_data: dict):
-    job_path = _get_job_path(job_id)
-    with open(job_path, "w") as f:
-        json.dump(job_data, f)
-
-
 # --- Temporary Storage Configuration ---
-TEMP_STORAGE_PATH = "./api_temp_storage"
+# Staging area for uploads; can be pointed at a tmpfs mount such as /dev/shm
+TEMP_STORAGE_PATH = os.environ.get("TEMP_STORAGE_PATH", "./api_temp_storage")
 os.makedirs(TEMP_STORAGE_PATH, exist_ok=True)
 
+# Chunk size used when streaming GCS downloads back to the client; 1 MiB
+# keeps the number of ranged reads against GCS low
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Video file extensions accepted for direct uploads
+ALLOWED_UPLOAD_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm')
+
 # --- Helper Functions ---
 
+# Job store statuses for which the live Transcoder state is checked
+_LIVE_TRANSCODER_JOB_STATUSES = frozenset({JobStatus.SUBMITTED, JobStatus.IN_PROGRESS})
+# Transcoder job states that mean the job is still running
+_TRANSCODER_ACTIVE_STATES = frozenset({"RUNNING", "PENDING"})
+
 def _queue_background_job(background_tasks: BackgroundTasks, task_function, request):
     job_id = str(uuid.uuid4())
-    _write_job(job_id, {"status": "queued"})
+    _write_job(job_id, {"status": JobStatus.QUEUED})
     background_tasks.add_task(task_function, job_id, request)
-    return {"job_id": job_id, "status": "queued"}
+    return {"job_id": job_id, "status": JobStatus.QUEUED}
 
 # --- API Endpoints ---
 
@@ -113,17 +144,24 @@ async def list_workspaces(gcs_bucket: str = Query(None)):
 
 
 @app.get("/gcs/list", tags=["GCS"])
-async def list_gcs_files_endpoint(gcs_bucket: str = Query(None), prefix: str = Query("")):
-    """Lists files in a GCS bucket with a given prefix."""
+async def list_gcs_files_endpoint(
+    gcs_bucket: str = Query(None),
+    prefix: str = Query(""),
+    max_results: int = Query(gcs_service.MAX_LIST_RESULTS, ge=1),
+):
+    """Lists files in a GCS bucket with a given prefix, returning at most `max_results` names."""
     try:
-        files, error = gcs_service.list_gcs_files(gcs_bucket, prefix)
+        # One extra name is requested; getting it back means the folder holds more
+        # than `max_results` files
+        files, error = gcs_service.list_gcs_files(gcs_bucket, prefix, max_results=max_results + 1)
         if error:
-            # Distinguish between a folder not found and other errors
+            # An empty folder, e.g. in a new workspace, is a normal listing rather than an error
             if "No files found" in error:
-                raise HTTPException(status_code=404, detail=error)
-            else:
-                raise HTTPException(status_code=500, detail=error)
-        return {"files": files}
+                return {"files": [], "truncated": False}
+            raise HTTPException(status_code=500, detail=error)
+        return {"files": files[:max_results], "truncated": len(files) > max_results}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -147,7 +185,7 @@ async def get_job_status(job_id: str):
     
     # If this is a transcoder job and still in progress, get live status
     if (job.get("transcoder_job_name") and
-        job.get("status") in ["submitted", "in_progress"]):
+        job.get("status") in _LIVE_TRANSCODER_JOB_STATUSES):
         
         try:
             from task_service import get_transcoder_job_status  # Import your helper
@@ -157,17 +195,17 @@ async def get_job_status(job_id: str):
             
             # Update job status based on transcoder state
             if transcoder_state == "SUCCEEDED":
-                job["status"] = "completed"
+                job["status"] = JobStatus.COMPLETED
                 job["details"] = f"Video splitting completed successfully. {job.get('num_segments', 'Multiple')} segments created."
                 _write_job(job_id, job)  # Persist the update
                 
             elif transcoder_state == "FAILED":
-                job["status"] = "failed"
+                job["status"] = JobStatus.FAILED
                 job["details"] = transcoder_details
                 _write_job(job_id, job)
                 
-            elif transcoder_state in ["RUNNING", "PENDING"]:
-                job["status"] = "in_progress"
+            elif transcoder_state in _TRANSCODER_ACTIVE_STATES:
+                job["status"] = JobStatus.IN_PROGRESS
                 job["details"] = f"Transcoder job {transcoder_state.lower()}..."
                 # Don't persist these temporary updates
             
@@ -197,13 +235,12 @@ async def generate_upload_url(request: UploadURLRequest):
     
     try:
         # Validate file extension (optional - add your allowed extensions)
-        allowed_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm']
         file_extension = os.path.splitext(request.file_name.lower())[1]
         
-        if file_extension not in allowed_extensions:
+        if file_extension not in ALLOWED_UPLOAD_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
-                detail=f"File type {file_extension} not supported. Allowed: {allowed_extensions}"
+                detail=f"File type {file_extension} not supported. Allowed: {list(ALLOWED_UPLOAD_EXTENSIONS)}"
             )
         
         # Generate unique blob name to avoid conflicts
@@ -227,7 +264,7 @@ async def generate_upload_url(request: UploadURLRequest):
         )
         
     except Exception as e:
-        print(f"Error generating signed URL: {str(e)}")
+        logging.error(f"Error generating signed URL: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to generate upload URL: {str(e)}"
@@ -236,6 +273,7 @@ async def generate_upload_url(request: UploadURLRequest):
 
 @app.post("/upload-video/", tags=["Video Processing"], response_model=UploadResponse)
 async def upload_video_endpoint(
+    background_tasks: BackgroundTasks,
     workspace: str = Form(...),
     gcs_bucket: str = Form(...),
     video_file: UploadFile = Form(...),
@@ -262,17 +300,17 @@ async def upload_video_endpoint(
         if not success:
             raise HTTPException(status_code=500, detail=f"GCS Upload failed: {error}")
 
+        # The local copy is no longer needed; it is removed after the response is sent
+        background_tasks.add_task(shutil.rmtree, temp_dir, ignore_errors=True)
         return UploadResponse(
             gcs_bucket=gcs_bucket,
             gcs_blob_name=gcs_blob_name,
             workspace=workspace,
         )
     except Exception as e:
+        # Background tasks don't run for error responses, so clean up here
+        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Clean up the temporary directory
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
 
 
 @app.post("/upload-cast-photo", tags=["Video Processing"], response_model=UploadResponse)
@@ -282,20 +320,13 @@ async def upload_cast_photo_endpoint(
     photo_file: UploadFile = File(...),
 ):
     """
-    Handles cast photo uploads to the server, then to GCS.
+    Streams cast photo uploads straight to GCS.
+    The request body is already spooled by FastAPI, so it is not copied to a temp file first.
     """
-    upload_id = str(uuid.uuid4())
-    temp_dir = os.path.join(TEMP_STORAGE_PATH, "uploads", upload_id)
-    os.makedirs(temp_dir, exist_ok=True)
-    local_photo_path = os.path.join(temp_dir, photo_file.filename)
-
     try:
-        with open(local_photo_path, "wb") as buffer:
-            shutil.copyfileobj(photo_file.file, buffer)
-
         gcs_blob_name = os.path.join(workspace, "cast_photos", photo_file.filename)
 
-        success, error = gcs_service.upload_gcs_blob(gcs_bucket, local_photo_path, gcs_blob_name)
+        success, error = gcs_service.upload_gcs_blob_from_stream(gcs_bucket, photo_file.file, gcs_blob_name)
         if not success:
             raise HTTPException(status_code=500, detail=f"GCS Upload failed: {error}")
 
@@ -306,9 +337,6 @@ async def upload_cast_photo_endpoint(
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
 
 
 # --- Video Processing Endpoints ---
@@ -341,10 +369,16 @@ async def delete_gcs_blob_endpoint(request: GCSDeleteRequest):
 async def delete_gcs_blob_batch_endpoint(request: GCSBatchDeleteRequest):
     """Deletes multiple blobs from GCS in a single batch."""
     try:
-        success, error = gcs_service.delete_gcs_blobs_batch(request.gcs_bucket, request.blob_names)
-        if not success:
-            raise HTTPException(status_code=500, detail=error)
-        return {"message": f"Batch deletion successful for bucket '{request.gcs_bucket}'."}
+        deleted_files, failed_files = gcs_service.delete_gcs_blobs_batch(request.gcs_bucket, request.blob_names)
+        if failed_files and not deleted_files:
+            raise HTTPException(
+                status_code=500, detail="; ".join(f"{name}: {error}" for name, error in failed_files.items())
+            )
+        return {
+            "message": f"Batch deletion finished for bucket '{request.gcs_bucket}'.",
+            "deleted_files": deleted_files,
+            "failed_files": failed_files,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -362,32 +396,28 @@ async def get_signed_url_endpoint(gcs_bucket: str = Query(None), blob_name: str
 
 @app.get("/gcs/download/{blob_name:path}", tags=["GCS"])
 async def download_gcs_file_endpoint(gcs_bucket: str, blob_name: str):
-    """Downloads a file from GCS and returns its content."""
-    # This is a simplified example. In a real-world scenario, you would
-    # stream the response or handle large files more carefully.
-    from fastapi.responses import Response
-    import io
-
+    """Streams a file's content from GCS in chunks."""
     storage_client = gcs_service.get_storage_client()
     bucket = storage_client.bucket(gcs_bucket)
     blob = bucket.blob(blob_name)
 
-    if not blob.exists():
-        raise HTTPException(status_code=404, detail="File not found in GCS.")
-
     try:
-        # Download the file's content into a BytesIO buffer
-        file_buffer = io.BytesIO()
-        blob.download_to_file(file_buffer)
-        file_buffer.seek(0)  # Rewind the buffer to the beginning
+        # A single metadata fetch both checks existence and provides the content type
+        blob.reload()
+    except NotFound:
+        raise HTTPException(status_code=404, detail="File not found in GCS.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to download file: {e}")
 
-        # Determine the content type (optional but good practice)
-        content_type = blob.content_type or "application/octet-stream"
+    content_type = blob.content_type or "application/octet-stream"
 
-        return Response(content=file_buffer.read(), media_type=content_type)
+    def _iter_blob():
+        # Chunks are passed through as they arrive instead of buffering the whole file
+        with blob.open("rb", chunk_size=DOWNLOAD_CHUNK_SIZE) as f:
+            while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+                yield chunk
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to download file: {e}")
+    return StreamingResponse(_iter_blob(), media_type=content_type)
 
 
 @app.post("/generate-metadata/", tags=["AI Processing"], status_code=202)
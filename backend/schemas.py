@@ -1,6 +1,20 @@
+from enum import Enum
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
+class JobStatus(str, Enum):
+    """Lifecycle states stored in the job store and returned by /jobs/{job_id}."""
+    QUEUED = "queued"
+    SUBMITTED = "submitted"
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class EncodeProfile(str, Enum):
+    """Speed/quality trade-off for clip encodes; drafts encode faster but produce larger files."""
+    DRAFT = "draft"
+    FINAL = "final"
+
 class TrailerClipMetadata(BaseModel):
     """Pydantic model for a single trailer clip's metadata."""
     source_filename: str = Field(description="The filename of the video clip being analyzed.")
@@ -55,6 +69,7 @@ class ClipGenerationRequest(BaseModel):
     gcs_bucket: str
     metadata_blob_names: list[str]  # GCS paths to the metadata files
     output_gcs_prefix: str
+    encode_profile: EncodeProfile = EncodeProfile.FINAL
 
 
 class JoinRequest(BaseModel):
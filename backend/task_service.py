@@ -1,10 +1,17 @@
+import io
 import json
 import os
+import queue
+import asyncio
 import math
+import functools
+import re
 import logging
-import shutil
+import string
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import requests
+import orjson
 
 # Import Google Cloud clients
 from google.cloud.video.transcoder_v1.services.transcoder_service import TranscoderServiceClient
@@ -17,6 +24,8 @@ import ai_service
 
 # Import schemas
 from schemas import (
+    JobStatus,
+    EncodeProfile,
     FaceClipGenerationRequest,
     SplitRequest,
     MetadataRequest,
@@ -35,16 +44,18 @@ def _get_job_path(job_id: str) -> str:
 
 def _read_job(job_id: str) -> dict:
     job_path = _get_job_path(job_id)
-    if not os.path.exists(job_path):
-        return None
+    # A missing file surfaces as FileNotFoundError (an IOError) from open(), so no
+    # separate exists() check is needed before reading
     try:
         with open(job_path, "r") as f:
             try:
                 data = json.load(f)
             except json.JSONDecodeError:
+                # If the file is empty or malformed, return None
                 return None
         return data
     except (IOError, json.JSONDecodeError):
+        # Return None if the file is locked or empty, allowing the client to retry
         return None
 
 def _write_job(job_id: str, job_data: dict):
@@ -53,9 +64,91 @@ def _write_job(job_id: str, job_data: dict):
         json.dump(job_data, f)
 
 # --- Temporary Storage Configuration ---
-TEMP_STORAGE_PATH = "./api_temp_storage"
+# Scratch space for job files; point it at a tmpfs mount (e.g. /dev/shm) to keep it off disk
+TEMP_STORAGE_PATH = os.environ.get("TEMP_STORAGE_PATH", "./api_temp_storage")
 os.makedirs(TEMP_STORAGE_PATH, exist_ok=True)
 
+# Minimum time between two in-progress job store writes for the same job
+PROGRESS_FLUSH_INTERVAL_SECONDS = 0.5
+
+# Maximum number of videos processed concurrently by a metadata generation job
+METADATA_MAX_CONCURRENCY = int(os.environ.get("METADATA_MAX_CONCURRENCY", 4))
+# Upper bound on metadata files downloaded at once when generating clips
+METADATA_DOWNLOAD_MAX_WORKERS = 16
+# Upper bound on concurrent Transcoder API requests made by a single job
+TRANSCODER_API_MAX_WORKERS = 4
+# H.264 preset per clip encode profile; veryfast is the Transcoder API default
+CLIP_H264_PRESETS = {
+    EncodeProfile.DRAFT: "ultrafast",
+    EncodeProfile.FINAL: "veryfast",
+}
+
+
+def _extract_json_payload(content: str) -> str:
+    """
+    Returns the JSON array/object embedded in model output.
+
+    A single scan from the first opening bracket to the last closing bracket drops any
+    ```json fence or surrounding prose. Content without brackets is returned unchanged
+    so the JSON parser reports the error.
+    """
+    starts = [pos for pos in (content.find("["), content.find("{")) if pos != -1]
+    if not starts:
+        return content
+    start = min(starts)
+    end = max(content.rfind("]"), content.rfind("}"))
+    return content[start:end + 1] if end > start else content[start:]
+
+
+def _load_json_payload(content):
+    """
+    Parses JSON from model output or a stored metadata file (str or UTF-8 bytes).
+
+    Well-formed input is parsed directly; only when that fails is the payload
+    extracted from fences or surrounding prose and parsed again.
+    """
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        return orjson.loads(_extract_json_payload(content))
+
+
+# [[HH:]MM:]SS[.fff]; the nesting fills minutes before hours for MM:SS timecodes
+_TIMECODE_RE = re.compile(r"(?:(?:(\d+):)?(\d+):)?(\d+)(?:\.(\d+))?")
+
+
+# Clip boundaries recur across metadata files and re-runs over the same files
+@functools.lru_cache(maxsize=1024)
+def _parse_timecode(timecode: str) -> float:
+    """Converts an HH:MM:SS(.fff) timecode to seconds, raising ValueError if malformed."""
+    match = _TIMECODE_RE.fullmatch(timecode.strip())
+    if not match:
+        raise ValueError(f"Invalid timecode: {timecode!r}")
+    hours, minutes, seconds, fraction = match.groups()
+    total = int(seconds) + int(minutes or 0) * 60 + int(hours or 0) * 3600
+    return total + float(f"0.{fraction}") if fraction else total
+
+
+# Values filled into the metadata prompt for each video
+_PROMPT_PLACEHOLDERS = ("source_filename", "actual_video_duration", "language")
+
+
+def _parse_prompt_template(template: str) -> string.Template:
+    """
+    Parses a metadata prompt into a string.Template.
+    Templates still written with the older {{name}} placeholders are converted to ${name};
+    any literal "$" in them is escaped first so it reaches the model unchanged.
+    """
+    legacy_placeholders = {f"{{{{{name}}}}}": f"${{{name}}}" for name in _PROMPT_PLACEHOLDERS}
+    if any(placeholder in template for placeholder in legacy_placeholders):
+        template = template.replace("$", "$$")
+        for legacy, placeholder in legacy_placeholders.items():
+            template = template.replace(legacy, placeholder)
+    return string.Template(template)
+
+
 # --- Cloud Tasks Helper ---
 def create_face_recognition_task(request_data: dict, job_id: str) -> str:
     """
@@ -102,40 +195,77 @@ def create_face_recognition_task(request_data: dict, job_id: str) -> str:
     logging.info(f"Created Cloud Task: {response.name}")
     return response.name
 
-# --- File-based Job Store ---
-JOB_STORE_PATH = "./job_store"
-os.makedirs(JOB_STORE_PATH, exist_ok=True)
-
-
-def _get_job_path(job_id: str) -> str:
-    return os.path.join(JOB_STORE_PATH, f"{job_id}.json")
-
+def _submit_transcoder_jobs(
+    job_id: str, transcoder_client: TranscoderServiceClient, parent: str, transcoder_jobs: list, label: str
+) -> list:
+    """
+    Submits (output_name, transcoder Job) pairs and returns the job names in input order.
 
-def _read_job(job_id: str) -> dict:
-    job_path = _get_job_path(job_id)
-    if not os.path.exists(job_path):
-        return None
-    try:
-        with open(job_path, "r") as f:
+    create_job is a network round trip per job, so the requests are sent from a bounded
+    pool to stay within the Transcoder API quota. Progress is written from the calling
+    thread only, so the job store file never sees concurrent writers.
+    """
+    max_workers = max(1, min(TRANSCODER_API_MAX_WORKERS, len(transcoder_jobs)))
+    submitted = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(transcoder_client.create_job, parent=parent, job=transcoder_job): output_name
+            for output_name, transcoder_job in transcoder_jobs
+        }
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
             try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                # If the file is empty or malformed, return None
-                return None
-        return data
-    except (IOError, json.JSONDecodeError):
-        # Return None if the file is locked or empty, allowing the client to retry
-        return None
-
-
-def _write_job(job_id: str, job_data: dict):
-    job_path = _get_job_path(job_id)
-    with open(job_path, "w") as f:
-        json.dump(job_data, f)
-
-# --- Temporary Storage Configuration ---
-TEMP_STORAGE_PATH = "./api_temp_storage"
-os.makedirs(TEMP_STORAGE_PATH, exist_ok=True)
+                job_name = future.result().name
+            except Exception as e:
+                if failure is None:
+                    failure = e
+                    # Requests not yet sent are dropped; those in flight still finish
+                    for pending in futures:
+                        pending.cancel()
+                continue
+            submitted[future] = job_name
+            details = f"Submitted job for {label} {len(submitted)}/{len(transcoder_jobs)}: {futures[future]}"
+            _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": details})
+            logging.info(f"Job {job_id}: Transcoder job {job_name} submitted ({details})")
+
+    if failure is not None:
+        # The batch is abandoned, so jobs that were already created would otherwise keep
+        # running and billing with nothing monitoring them
+        undeleted = _delete_transcoder_jobs(job_id, transcoder_client, list(submitted.values()))
+        if undeleted:
+            raise RuntimeError(
+                f"{failure}. These transcoder jobs could not be deleted and may still be running: "
+                f"{', '.join(undeleted)}"
+            ) from failure
+        raise failure
+    return [submitted[future] for future in futures]
+
+
+def _delete_transcoder_jobs(job_id: str, transcoder_client: TranscoderServiceClient, job_names: list) -> list:
+    """Deletes the given Transcoder jobs, stopping any still running. Returns the names that could not be deleted."""
+    undeleted = []
+    for job_name in job_names:
+        try:
+            transcoder_client.delete_job(name=job_name)
+            logging.info(f"Job {job_id}: Deleted transcoder job {job_name} after a failed submission.")
+        except Exception as e:
+            logging.error(f"Job {job_id}: Failed to delete transcoder job {job_name}: {e}")
+            undeleted.append(job_name)
+    return undeleted
+
+def _get_transcoder_jobs(transcoder_client: TranscoderServiceClient, job_names: list) -> list:
+    """
+    Fetches the given Transcoder jobs and returns them in input order.
+    Each get_job is a separate round trip, so a poll sends them from the same bounded
+    pool used for submissions instead of waiting on one job after another.
+    """
+    if not job_names:
+        return []
+    max_workers = min(TRANSCODER_API_MAX_WORKERS, len(job_names))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda name: transcoder_client.get_job(name=name), job_names))
 
 def process_splitting(job_id: str, request: SplitRequest):
     """
@@ -144,12 +274,12 @@ def process_splitting(job_id: str, request: SplitRequest):
     """
     from google.cloud.video import transcoder_v1
     
-    _write_job(job_id, {"status": "in_progress", "details": "Starting video split process."})
+    _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": "Starting video split process."})
     logging.info(f"Job {job_id}: Starting video split process using Transcoder API.")
 
     try:
         # Initialize Transcoder client
-        transcoder_client = TranscoderServiceClient()
+        transcoder_client = video_service.get_transcoder_client()
         project_id = os.environ["GOOGLE_CLOUD_PROJECT"]
         location = os.environ["GOOGLE_CLOUD_LOCATION"]  # Should match your GCS bucket region
         parent = f"projects/{project_id}/locations/{location}"
@@ -159,15 +289,11 @@ def process_splitting(job_id: str, request: SplitRequest):
         base_filename = os.path.basename(request.gcs_blob_name)
         base_name, ext = os.path.splitext(base_filename)
         
-        _write_job(job_id, {"status": "in_progress", "details": f"Processing {input_uri}..."})
+        _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": f"Processing {input_uri}..."})
         logging.info(f"Job {job_id}: Processing {input_uri}")
 
         # 2. Get video duration using your existing function
-        signed_url, url_error = gcs_service.generate_signed_url(request.gcs_bucket, request.gcs_blob_name)
-        if url_error:
-            raise Exception(f"Failed to generate signed URL for duration check: {url_error}")
-        
-        total_duration, duration_error = video_service.get_video_duration(signed_url)
+        total_duration, duration_error = video_service.get_video_duration_from_gcs(request.gcs_bucket, request.gcs_blob_name)
         if duration_error or total_duration <= 0:
             raise Exception(f"Failed to get video duration: {duration_error}")
 
@@ -175,7 +301,7 @@ def process_splitting(job_id: str, request: SplitRequest):
 
         # 3. Calculate segments
         num_segments = math.ceil(total_duration / request.segment_duration)
-        _write_job(job_id, {"status": "in_progress", "details": f"Will create {num_segments} segments..."})
+        _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": f"Will create {num_segments} segments..."})
         
         # 4. Create separate transcoder jobs for each segment
         output_prefix = os.path.join(request.workspace, "segments")
@@ -200,7 +326,7 @@ def process_splitting(job_id: str, request: SplitRequest):
             ),
         ]
         
-        transcoder_job_names = []
+        transcoder_jobs = []  # (segment_filename, transcoder Job) in segment order
         
         for i in range(num_segments):
             start = i * request.segment_duration
@@ -232,19 +358,12 @@ def process_splitting(job_id: str, request: SplitRequest):
                 output=transcoder_v1.types.Output(uri=f"gs://{request.gcs_bucket}/{output_prefix}/"),
             )
             
-            # Submit individual transcoder job
-            transcoder_job = transcoder_v1.types.Job(config=job_config)
-            
-            _write_job(job_id, {"status": "in_progress", "details": f"Submitting job for segment {i+1}/{num_segments}..."})
-            logging.info(f"Job {job_id}: Submitting transcoder job for segment {i+1}")
-            
-            response = transcoder_client.create_job(parent=parent, job=transcoder_job)
-            transcoder_job_names.append(response.name)
-            
-            logging.info(f"Job {job_id}: Segment {i+1} job {response.name} submitted")
+            transcoder_jobs.append((segment_filename, transcoder_v1.types.Job(config=job_config)))
+
+        transcoder_job_names = _submit_transcoder_jobs(job_id, transcoder_client, parent, transcoder_jobs, "segment")
 
         _write_job(job_id, {
-            "status": "submitted",
+            "status": JobStatus.SUBMITTED,
             "details": f"{num_segments} transcoder jobs submitted. Processing segments...",
             "transcoder_job_names": transcoder_job_names,
             "num_segments": num_segments
@@ -258,11 +377,9 @@ def process_splitting(job_id: str, request: SplitRequest):
         
         while elapsed_time < max_wait_time and len(completed_jobs) < len(transcoder_job_names):
             try:
-                for job_name in transcoder_job_names:
-                    if job_name in completed_jobs:
-                        continue
-                        
-                    job_status = transcoder_client.get_job(name=job_name)
+                pending_job_names = [name for name in transcoder_job_names if name not in completed_jobs]
+                pending_jobs = _get_transcoder_jobs(transcoder_client, pending_job_names)
+                for job_name, job_status in zip(pending_job_names, pending_jobs):
                     state = job_status.state.name
                     
                     if state == "SUCCEEDED":
@@ -275,12 +392,12 @@ def process_splitting(job_id: str, request: SplitRequest):
                 
                 if len(completed_jobs) == len(transcoder_job_names):
                     final_details = f"Successfully split video into {num_segments} segments in gs://{request.gcs_bucket}/{output_prefix}/"
-                    _write_job(job_id, {"status": "completed", "details": final_details})
+                    _write_job(job_id, {"status": JobStatus.COMPLETED, "details": final_details})
                     logging.info(f"Job {job_id}: {final_details}")
                     return
                 else:
                     progress_msg = f"Processing segments... ({len(completed_jobs)}/{len(transcoder_job_names)} completed, {elapsed_time}s elapsed)"
-                    _write_job(job_id, {"status": "in_progress", "details": progress_msg})
+                    _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": progress_msg})
                     logging.info(f"Job {job_id}: {progress_msg}")
                 
                 time.sleep(poll_interval)
@@ -297,7 +414,7 @@ def process_splitting(job_id: str, request: SplitRequest):
 
     except Exception as e:
         error_msg = f"Video splitting failed: {str(e)}"
-        _write_job(job_id, {"status": "failed", "details": error_msg})
+        _write_job(job_id, {"status": JobStatus.FAILED, "details": error_msg})
         logging.error(f"Job {job_id}: {error_msg}")
 
 # Helper function to check transcoder job status
@@ -307,7 +424,7 @@ def get_transcoder_job_status(transcoder_job_name: str) -> tuple[str, str]:
     Returns (state, details)
     """
     try:
-        transcoder_client = TranscoderServiceClient()
+        transcoder_client = video_service.get_transcoder_client()
         job = transcoder_client.get_job(name=transcoder_job_name)
         state = job.state.name
         
@@ -321,142 +438,233 @@ def get_transcoder_job_status(transcoder_job_name: str) -> tuple[str, str]:
     except Exception as e:
         return "ERROR", f"Failed to check status: {str(e)}"
 
+async def _publish_job_progress(job_id: str, progress_queue: queue.Queue):
+    """
+    Writes in-progress updates for a job as they arrive on `progress_queue`.
+    This task is the only writer of the job record while the job runs, so
+    per-video workers never touch the job store directly. Bursts of updates are
+    coalesced into at most one write per PROGRESS_FLUSH_INTERVAL_SECONDS carrying
+    the latest message. Stops on a None sentinel.
+    """
+    while True:
+        details = await asyncio.to_thread(progress_queue.get)
+        stop = details is None
+        # Drain everything that is already queued and keep only the newest message
+        while not stop:
+            try:
+                next_details = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if next_details is None:
+                stop = True
+            else:
+                details = next_details
+
+        if details is not None:
+            _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": details})
+        if stop:
+            return
+        await asyncio.sleep(PROGRESS_FLUSH_INTERVAL_SECONDS)
+
+
+async def _generate_metadata_for_video(
+    job_id: str,
+    request: MetadataRequest,
+    gcs_uri: str,
+    blob_name: str,
+    video_basename: str,
+    progress_queue: queue.Queue,
+    prompt_template: string.Template,
+) -> tuple[str, str]:
+    """
+    Generates, validates and uploads the metadata file for a single video segment.
+    Blocking GCS and ffprobe calls run in worker threads so the event loop stays responsive.
+    Returns a tuple of (metadata_gcs_uri, error_message).
+    """
+    # The video itself is never downloaded; see get_video_duration_from_gcs
+    duration_seconds, duration_error = await asyncio.to_thread(
+        video_service.get_video_duration_from_gcs, request.gcs_bucket, blob_name
+    )
+    if duration_error:
+        logging.error(f"Job {job_id}: Failed to get duration for {gcs_uri}. Skipping. Error: {duration_error}")
+        return None, f"Could not read duration: {duration_error}"
+
+    # Format duration to HH:MM:SS
+    duration_str = f"{int(duration_seconds // 3600):02d}:{int((duration_seconds % 3600) // 60):02d}:{int(duration_seconds % 60):02d}"
+
+    prompt = prompt_template.safe_substitute(
+        source_filename=video_basename,
+        actual_video_duration=duration_str,
+        language=request.language,
+    )
+
+    metadata_json_str, error = await ai_service.generate_content_async(prompt, gcs_uri, request.ai_model_name)
+
+    if error:
+        logging.error(f"Job {job_id}: Failed to generate metadata for {gcs_uri}. Error: {error}")
+        return None, f"AI generation failed: {error}"
+    if not metadata_json_str:
+        logging.warning(f"Job {job_id}: No metadata generated for {gcs_uri}. Skipping.")
+        return None, "No metadata generated."
+
+    try:
+        metadata_objects = _load_json_payload(metadata_json_str)
+    except orjson.JSONDecodeError as e:
+        logging.error(f"Job {job_id}: Failed to parse metadata JSON for {gcs_uri}. Error: {e}")
+        return None, f"Invalid metadata JSON: {e}"
+
+    validated_metadata = []
+    if isinstance(metadata_objects, list):
+        for obj in metadata_objects:
+            if isinstance(obj, dict):
+                # Validate timestamp
+                timestamp = obj.get("timestamp_start_end")
+                if timestamp:
+                    try:
+                        start_str, end_str = timestamp.split(" - ")
+                        end_secs = _parse_timecode(end_str)
+                        if end_secs <= duration_seconds:
+                            obj["source_filename"] = gcs_uri
+                            # Stored so clip generation can bounds-check without probing the source again
+                            obj["source_duration_seconds"] = duration_seconds
+                            validated_metadata.append(obj)
+                        else:
+                            logging.warning(
+                                f"Job {job_id}: Discarding invalid timestamp {timestamp} for video {gcs_uri} with duration {duration_seconds}s."
+                            )
+                    except (ValueError, AttributeError):
+                        logging.warning(
+                            f"Job {job_id}: Discarding malformed timestamp '{timestamp}' for video {gcs_uri}."
+                        )
+                else:
+                    logging.warning(
+                        f"Job {job_id}: Discarding metadata object with missing timestamp for video {gcs_uri}."
+                    )
+
+    if not validated_metadata:
+        logging.warning(f"Job {job_id}: No valid metadata generated for {gcs_uri} after validation. Skipping.")
+        return None, "No valid metadata after timestamp validation."
+
+    # Even if the AI returns a list, we save it to a file specific to this video.
+    output_filename = f"{os.path.splitext(video_basename)[0]}_metadata.json"
+    # The file is small, so it is serialized in memory and uploaded without a local copy
+    metadata_bytes = orjson.dumps(validated_metadata, option=orjson.OPT_INDENT_2)
+
+    # Upload the individual metadata file
+    metadata_blob_name = os.path.join(request.workspace, request.gcs_output_prefix, output_filename)
+    upload_details = f"Uploading metadata for {video_basename} to {metadata_blob_name}"
+    progress_queue.put(upload_details)
+    logging.info(f"Job {job_id}: {upload_details}")
+
+    success, upload_error = await asyncio.to_thread(
+        gcs_service.upload_gcs_blob_from_stream,
+        request.gcs_bucket,
+        io.BytesIO(metadata_bytes),
+        metadata_blob_name,
+        "application/json",
+    )
+    if not success:
+        logging.error(f"Job {job_id}: Failed to upload metadata for {video_basename}. Error: {upload_error}")
+        return None, f"Upload failed: {upload_error}"
+
+    return f"gs://{request.gcs_bucket}/{metadata_blob_name}", None
+
+
 async def process_metadata_generation(job_id: str, request: MetadataRequest):
     """
     The actual logic for the metadata generation background task.
     This version generates one metadata JSON file per video segment.
     """
-    _write_job(job_id, {"status": "in_progress", "details": "Starting metadata generation."})
+    _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": "Starting metadata generation."})
     logging.info(f"Job {job_id}: Starting metadata generation for {len(request.gcs_video_uris)} videos.")
 
-    job_temp_dir = os.path.join(TEMP_STORAGE_PATH, job_id)
-    os.makedirs(job_temp_dir, exist_ok=True)
-
     processed_files_count = 0
     generated_metadata_files = []
+    # Per-file failures are recorded as they happen so the final status can
+    # report them without re-scanning the results afterwards.
+    failed_files = {}
 
     try:
         # The AI service is now configured automatically via environment variables.
         # No explicit configuration call is needed.
 
-        for i, gcs_uri in enumerate(request.gcs_video_uris):
-            video_basename = os.path.basename(gcs_uri)
-            details = f"Processing video {i+1}/{len(request.gcs_video_uris)}: {video_basename}"
-            _write_job(job_id, {"status": "in_progress", "details": details})
-            logging.info(f"Job {job_id}: {details}")
-
-            # Download the video to get its duration
-            local_video_path = os.path.join(job_temp_dir, video_basename)
-            success, download_error = gcs_service.download_gcs_blob(
-                request.gcs_bucket, gcs_uri.split(f"gs://{request.gcs_bucket}/")[1], local_video_path
-            )
-            if not success:
-                logging.error(
-                    f"Job {job_id}: Failed to download video {gcs_uri} to get duration. Skipping. Error: {download_error}"
+        # Resolve blob names and basenames once up front; they are reused for
+        # downloads, prompts, output names and failure reporting. Repeated URIs
+        # are processed once, since they would only overwrite the same output file.
+        bucket_uri_prefix = f"gs://{request.gcs_bucket}/"
+        videos = [
+            (gcs_uri, gcs_uri.removeprefix(bucket_uri_prefix), os.path.basename(gcs_uri))
+            for gcs_uri in dict.fromkeys(request.gcs_video_uris)
+        ]
+        total_videos = len(videos)
+        # The template is parsed once per job; each video only fills in its
+        # own ${source_filename}, ${actual_video_duration} and ${language}.
+        prompt_template = _parse_prompt_template(request.prompt_template)
+
+        progress_queue = queue.Queue()
+        progress_writer = asyncio.create_task(_publish_job_progress(job_id, progress_queue))
+        # Gemini calls are I/O bound, so several videos are processed at once,
+        # bounded to stay within the model's request quota.
+        concurrency_limit = asyncio.Semaphore(METADATA_MAX_CONCURRENCY)
+
+        async def _process_video(i: int, gcs_uri: str, blob_name: str, video_basename: str) -> tuple[str, str]:
+            async with concurrency_limit:
+                details = f"Processing video {i+1}/{total_videos}: {video_basename}"
+                progress_queue.put(details)
+                logging.info(f"Job {job_id}: {details}")
+                return await _generate_metadata_for_video(
+                    job_id,
+                    request,
+                    gcs_uri,
+                    blob_name,
+                    video_basename,
+                    progress_queue,
+                    prompt_template,
                 )
-                continue
-
-            duration_seconds, duration_error = video_service.get_video_duration(local_video_path)
-            if duration_error:
-                logging.error(f"Job {job_id}: Failed to get duration for {gcs_uri}. Skipping. Error: {duration_error}")
-                os.remove(local_video_path)  # Clean up
-                continue
-
-            # Format duration to HH:MM:SS
-            duration_str = f"{int(duration_seconds // 3600):02d}:{int((duration_seconds % 3600) // 60):02d}:{int(duration_seconds % 60):02d}"
-
-            prompt = request.prompt_template.replace("{{source_filename}}", video_basename)
-            prompt = prompt.replace("{{actual_video_duration}}", duration_str)
-            prompt = prompt.replace("{{language}}", request.language)
 
-            metadata_json_str, error = await ai_service.generate_content_async(prompt, gcs_uri, request.ai_model_name)
-
-            # Clean up the downloaded video file
-            os.remove(local_video_path)
-            if error:
-                logging.error(f"Job {job_id}: Failed to generate metadata for {gcs_uri}. Error: {error}")
-                continue
-            if not metadata_json_str:
-                logging.warning(f"Job {job_id}: No metadata generated for {gcs_uri}. Skipping.")
-                continue
-
-            try:
-                if metadata_json_str.strip().startswith("```json"):
-                    metadata_json_str = metadata_json_str.strip()[7:-3]
-                metadata_objects = json.loads(metadata_json_str)
-
-                validated_metadata = []
-                if isinstance(metadata_objects, list):
-                    for obj in metadata_objects:
-                        if isinstance(obj, dict):
-                            # Validate timestamp
-                            timestamp = obj.get("timestamp_start_end")
-                            if timestamp:
-                                try:
-                                    start_str, end_str = timestamp.split(" - ")
-                                    end_secs = sum(x * int(t) for x, t in zip([3600, 60, 1], end_str.split(":")))
-                                    if end_secs <= duration_seconds:
-                                        obj["source_filename"] = gcs_uri
-                                        validated_metadata.append(obj)
-                                    else:
-                                        logging.warning(
-                                            f"Job {job_id}: Discarding invalid timestamp {timestamp} for video {gcs_uri} with duration {duration_seconds}s."
-                                        )
-                                except (ValueError, AttributeError):
-                                    logging.warning(
-                                        f"Job {job_id}: Discarding malformed timestamp '{timestamp}' for video {gcs_uri}."
-                                    )
-                            else:
-                                logging.warning(
-                                    f"Job {job_id}: Discarding metadata object with missing timestamp for video {gcs_uri}."
-                                )
-
-                if not validated_metadata:
-                    logging.warning(f"Job {job_id}: No valid metadata generated for {gcs_uri} after validation. Skipping.")
+        try:
+            results = await asyncio.gather(
+                *(_process_video(i, *video) for i, video in enumerate(videos)), return_exceptions=True
+            )
+            for (gcs_uri, _, video_basename), result in zip(videos, results):
+                if isinstance(result, Exception):
+                    # An unexpected error (e.g. exhausted AI retries) only fails this video
+                    logging.error(f"Job {job_id}: Unexpected error while processing {gcs_uri}: {result}")
+                    failed_files[video_basename] = str(result)
                     continue
-
-                # Even if the AI returns a list, we save it to a file specific to this video.
-                output_filename = f"{os.path.splitext(video_basename)[0]}_metadata.json"
-                local_metadata_path = os.path.join(job_temp_dir, output_filename)
-
-                with open(local_metadata_path, "w") as f:
-                    json.dump(validated_metadata, f, indent=2)
-
-                # Upload the individual metadata file
-                metadata_blob_name = os.path.join(request.workspace, request.gcs_output_prefix, output_filename)
-                upload_details = f"Uploading metadata for {video_basename} to {metadata_blob_name}"
-                _write_job(job_id, {"status": "in_progress", "details": upload_details})
-                logging.info(f"Job {job_id}: {upload_details}")
-
-                success, upload_error = gcs_service.upload_gcs_blob(
-                    request.gcs_bucket, local_metadata_path, metadata_blob_name
-                )
-                if success:
-                    processed_files_count += 1
-                    generated_metadata_files.append(f"gs://{request.gcs_bucket}/{metadata_blob_name}")
+                metadata_uri, error = result
+                if error:
+                    failed_files[video_basename] = error
                 else:
-                    logging.error(f"Job {job_id}: Failed to upload metadata for {video_basename}. Error: {upload_error}")
-
-            except json.JSONDecodeError as e:
-                logging.error(f"Job {job_id}: Failed to parse metadata JSON for {gcs_uri}. Error: {e}")
-                continue
+                    processed_files_count += 1
+                    generated_metadata_files.append(metadata_uri)
+        finally:
+            # Let the writer flush pending updates before the final status is written
+            progress_queue.put(None)
+            await progress_writer
 
         if processed_files_count == 0:
             final_details = "Metadata generation finished, but no valid metadata was produced or uploaded."
         else:
             final_details = f"Successfully generated and uploaded {processed_files_count} metadata file(s)."
+        if failed_files:
+            final_details += f" {len(failed_files)} file(s) could not be processed."
 
         _write_job(
-            job_id, {"status": "completed", "details": final_details, "generated_files": generated_metadata_files}
+            job_id,
+            {
+                "status": JobStatus.COMPLETED,
+                "details": final_details,
+                "generated_files": generated_metadata_files,
+                "has_errors": bool(failed_files),
+                "failed_files": failed_files,
+            },
         )
         logging.info(f"Job {job_id}: {final_details}")
 
     except Exception as e:
-        _write_job(job_id, {"status": "failed", "details": str(e)})
+        _write_job(job_id, {"status": JobStatus.FAILED, "details": str(e)})
         logging.error(f"Job {job_id}: Failed - {str(e)}")
-    finally:
-        if os.path.exists(job_temp_dir):
-            shutil.rmtree(job_temp_dir)
 
 def process_clip_generation(job_id: str, request: ClipGenerationRequest):
     """
@@ -465,33 +673,33 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
     """
     from google.cloud.video import transcoder_v1
     
-    _write_job(job_id, {"status": "in_progress", "details": "Starting clip generation."})
+    _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": "Starting clip generation."})
     logging.info(f"Job {job_id}: Starting clip generation from {len(request.metadata_blob_names)} metadata file(s).")
 
-    job_temp_dir = os.path.join(TEMP_STORAGE_PATH, job_id)
-    os.makedirs(job_temp_dir, exist_ok=True)
-
     clips_by_source_video = {}  # Key: source_blob_name, Value: list of clip_data
 
     try:
         # --- Step 1: Aggregate all clips from metadata files and group by source video ---
-        _write_job(job_id, {"status": "in_progress", "details": "Aggregating and grouping clips from metadata..."})
+        _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": "Aggregating and grouping clips from metadata..."})
         logging.info(f"Job {job_id}: Aggregating clips from {len(request.metadata_blob_names)} metadata files.")
 
-        for metadata_blob_name in request.metadata_blob_names:
-            local_metadata_path = os.path.join(job_temp_dir, os.path.basename(metadata_blob_name))
-            success, error = gcs_service.download_gcs_blob(request.gcs_bucket, metadata_blob_name, local_metadata_path)
-            if not success:
+        # Metadata files are small, so they are read into memory rather than staged on disk.
+        # The downloads are I/O bound, so they run concurrently before parsing in request order.
+        def _download_metadata(metadata_blob_name):
+            return gcs_service.download_gcs_blob_as_bytes(request.gcs_bucket, metadata_blob_name)
+
+        max_workers = max(1, min(METADATA_DOWNLOAD_MAX_WORKERS, len(request.metadata_blob_names)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            downloads = list(executor.map(_download_metadata, request.metadata_blob_names))
+
+        bucket_uri_prefix = f"gs://{request.gcs_bucket}/"
+        for metadata_blob_name, (metadata_bytes, error) in zip(request.metadata_blob_names, downloads):
+            if error:
                 logging.error(f"Job {job_id}: Failed to download metadata {metadata_blob_name}. Skipping. Error: {error}")
                 continue
 
-            with open(local_metadata_path, "r") as f:
-                metadata_content = f.read()
-
             try:
-                if metadata_content.strip().startswith("```json"):
-                    metadata_content = metadata_content.strip()[7:-3]
-                selected_clips = json.loads(metadata_content)
+                selected_clips = _load_json_payload(metadata_bytes)
                 if not isinstance(selected_clips, list):
                     selected_clips = [selected_clips] if isinstance(selected_clips, dict) else []
 
@@ -500,20 +708,19 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
                     if not source_gcs_uri:
                         continue
 
-                    if source_gcs_uri.startswith(f"gs://{request.gcs_bucket}/"):
-                        source_blob_name = source_gcs_uri.split(f"gs://{request.gcs_bucket}/", 1)[1]
-                        if source_blob_name not in clips_by_source_video:
-                            clips_by_source_video[source_blob_name] = []
-                        clips_by_source_video[source_blob_name].append(clip_data)
+                    # One partition pass both checks the bucket prefix and yields the blob name
+                    head, sep, source_blob_name = source_gcs_uri.partition(bucket_uri_prefix)
+                    if sep and not head:
+                        clips_by_source_video.setdefault(source_blob_name, []).append(clip_data)
                     else:
                         logging.warning(f"Job {job_id}: Skipping clip with invalid or mismatched GCS URI: {source_gcs_uri}")
 
-            except (json.JSONDecodeError, ValueError) as e:
+            except (orjson.JSONDecodeError, ValueError) as e:
                 logging.error(f"Job {job_id}: Invalid JSON in {metadata_blob_name}. Error: {e}")
                 continue
         
         # --- Step 2: Initialize Transcoder client and common settings ---
-        transcoder_client = TranscoderServiceClient()
+        transcoder_client = video_service.get_transcoder_client()
         project_id = os.environ["GOOGLE_CLOUD_PROJECT"]
         location = os.environ["GOOGLE_CLOUD_LOCATION"]
         parent = f"projects/{project_id}/locations/{location}"
@@ -525,6 +732,7 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
                     h264=transcoder_v1.types.VideoStream.H264CodecSettings(
                         bitrate_bps=2000000,
                         frame_rate=30,
+                        preset=CLIP_H264_PRESETS[request.encode_profile],
                     ),
                 ),
             ),
@@ -538,7 +746,7 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
         ]
 
         # --- Step 3: Create and submit a transcoder job for each clip ---
-        transcoder_job_names = []
+        transcoder_jobs = []  # (clip_filename, transcoder Job) in clip order
         total_clips_to_generate = sum(len(c) for c in clips_by_source_video.values())
         logging.info(f"Job {job_id}: Found {total_clips_to_generate} clips to generate from {len(clips_by_source_video)} unique source videos.")
         
@@ -549,18 +757,29 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
             for clip_data in clips_to_create:
                 time_range = clip_data.get("timestamp_start_end")
                 if not time_range:
-                    logging.warning(f"Job {job_id}: Skipping clip with missing 'timestamp_start_end': {clip_data}")
+                    logging.warning(f"Job {job_id}: Skipping clip with missing 'timestamp_start_end' from {source_blob_name}.")
+                    # The full clip payload is only formatted when debug logging is enabled
+                    logging.debug("Job %s: Clip without timestamp: %s", job_id, clip_data)
                     continue
 
                 try:
                     start_str, end_str = time_range.split(" - ")
-                    start_secs = sum(x * int(t) for x, t in zip([3600, 60, 1], start_str.split(":")))
-                    end_secs = sum(x * int(t) for x, t in zip([3600, 60, 1], end_str.split(":")))
-                    clip_duration = end_secs - start_secs
+                    start_secs = _parse_timecode(start_str)
+                    end_secs = _parse_timecode(end_str)
                 except (ValueError, AttributeError):
                     logging.warning(f"Job {job_id}: Invalid time format '{time_range}'. Skipping clip.")
                     continue
 
+                # Metadata written by this service carries the source duration, so edited
+                # timestamps can be bounds-checked without an ffprobe of the source video
+                source_duration = clip_data.get("source_duration_seconds")
+                if isinstance(source_duration, (int, float)):
+                    end_secs = min(end_secs, source_duration)
+                    if start_secs >= end_secs:
+                        logging.warning(f"Job {job_id}: Clip '{time_range}' is outside the {source_duration}s source video. Skipping clip.")
+                        continue
+                clip_duration = end_secs - start_secs
+
                 processed_clips_count += 1
                 clip_filename = f"{os.path.splitext(os.path.basename(source_blob_name))[0]}_clip_{processed_clips_count}_{clip_duration:.3f}s.mp4"
 
@@ -586,18 +805,12 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
                     output=transcoder_v1.types.Output(uri=f"gs://{request.gcs_bucket}/{request.workspace}/{request.output_gcs_prefix}/"),
                 )
 
-                transcoder_job = transcoder_v1.types.Job(config=job_config)
-                
-                details = f"Submitting job for clip {processed_clips_count}/{total_clips_to_generate}: {clip_filename}"
-                _write_job(job_id, {"status": "in_progress", "details": details})
-                logging.info(f"Job {job_id}: {details}")
+                transcoder_jobs.append((clip_filename, transcoder_v1.types.Job(config=job_config)))
 
-                response = transcoder_client.create_job(parent=parent, job=transcoder_job)
-                transcoder_job_names.append(response.name)
-                logging.info(f"Job {job_id}: Clip job {response.name} submitted")
+        transcoder_job_names = _submit_transcoder_jobs(job_id, transcoder_client, parent, transcoder_jobs, "clip")
 
         _write_job(job_id, {
-            "status": "submitted",
+            "status": JobStatus.SUBMITTED,
             "details": f"{len(transcoder_job_names)} transcoder jobs submitted for clip generation.",
             "transcoder_job_names": transcoder_job_names,
             "num_clips": len(transcoder_job_names)
@@ -612,11 +825,9 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
 
         while elapsed_time < max_wait_time and len(completed_jobs) < len(transcoder_job_names):
             try:
-                for job_name in transcoder_job_names:
-                    if job_name in completed_jobs:
-                        continue
-                    
-                    job_status = transcoder_client.get_job(name=job_name)
+                pending_job_names = [name for name in transcoder_job_names if name not in completed_jobs]
+                pending_jobs = _get_transcoder_jobs(transcoder_client, pending_job_names)
+                for job_name, job_status in zip(pending_job_names, pending_jobs):
                     state = job_status.state.name
                     
                     if state == "SUCCEEDED":
@@ -629,12 +840,12 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
                 
                 if len(completed_jobs) == len(transcoder_job_names):
                     final_details = f"Successfully generated {len(transcoder_job_names)} clips."
-                    _write_job(job_id, {"status": "completed", "details": final_details})
+                    _write_job(job_id, {"status": JobStatus.COMPLETED, "details": final_details})
                     logging.info(f"Job {job_id}: {final_details}")
                     return
                 else:
                     progress_msg = f"Processing clips... ({len(completed_jobs)}/{len(transcoder_job_names)} completed, {elapsed_time}s elapsed)"
-                    _write_job(job_id, {"status": "in_progress", "details": progress_msg})
+                    _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": progress_msg})
                     logging.info(f"Job {job_id}: {progress_msg}")
                 
                 time.sleep(poll_interval)
@@ -647,15 +858,12 @@ def process_clip_generation(job_id: str, request: ClipGenerationRequest):
         
         if len(completed_jobs) < len(transcoder_job_names):
             raise Exception(f"Clip generation timed out after {max_wait_time} seconds. {len(completed_jobs)}/{len(transcoder_job_names)} jobs completed.")
-        _write_job(job_id, {"status": "completed", "details": final_details, "generated_clips": generated_clip_blob_names})
+        _write_job(job_id, {"status": JobStatus.COMPLETED, "details": final_details, "generated_clips": generated_clip_blob_names})
         logging.info(f"Job {job_id}: Clip generation completed.")
 
     except Exception as e:
-        _write_job(job_id, {"status": "failed", "details": str(e)})
+        _write_job(job_id, {"status": JobStatus.FAILED, "details": str(e)})
         logging.error(f"Job {job_id}: Failed - {str(e)}")
-    finally:
-        if os.path.exists(job_temp_dir):
-            shutil.rmtree(job_temp_dir)
 
 def process_face_detection_and_copy(job_id: str, request: FaceClipGenerationRequest):
     """
@@ -663,7 +871,7 @@ def process_face_detection_and_copy(job_id: str, request: FaceClipGenerationRequ
     The actual copying logic will need to be handled differently, perhaps by another job
     or by inspecting the results of the face detection job. For now, this just dispatches the job.
     """
-    _write_job(job_id, {"status": "in_progress", "details": "Dispatching face detection job."})
+    _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": "Dispatching face detection job."})
     logging.info(f"Job {job_id}: Dispatching face detection job for video {request.gcs_video_uri}")
 
     try:
@@ -671,7 +879,7 @@ def process_face_detection_and_copy(job_id: str, request: FaceClipGenerationRequ
         request_data = request.dict()
         task_name = create_face_recognition_task(request_data, job_id)
         _write_job(job_id, {
-            "status": "submitted",
+            "status": JobStatus.SUBMITTED,
             "details": f"Successfully dispatched face detection job. Task: {task_name}",
             "task_name": task_name
         })
@@ -679,7 +887,7 @@ def process_face_detection_and_copy(job_id: str, request: FaceClipGenerationRequ
 
     except Exception as e:
         error_msg = f"Failed to dispatch face detection job: {str(e)}"
-        _write_job(job_id, {"status": "failed", "details": error_msg})
+        _write_job(job_id, {"status": JobStatus.FAILED, "details": error_msg})
         logging.error(f"Job {job_id}: {error_msg}", exc_info=True)
 
 def process_joining(job_id: str, request: JoinRequest):
@@ -688,7 +896,7 @@ def process_joining(job_id: str, request: JoinRequest):
     This version uses the Google Cloud Transcoder API.
     """
     import uuid
-    _write_job(job_id, {"status": "in_progress", "details": "Starting video joining process."})
+    _write_job(job_id, {"status": JobStatus.IN_PROGRESS, "details": "Starting video joining process."})
     
     try:
         # --- Data Transformation ---
@@ -719,7 +927,7 @@ def process_joining(job_id: str, request: JoinRequest):
         _write_job(
             job_id,
             {
-                "status": "submitted",
+                "status": JobStatus.SUBMITTED,
                 "details": f"Transcoder job '{job_name}' submitted for joining clips.",
                 "transcoder_job_name": job_name,
                 "output_uri": output_uri
@@ -728,7 +936,7 @@ def process_joining(job_id: str, request: JoinRequest):
         logging.info(f"Job {job_id}: Transcoder job '{job_name}' submitted.")
 
     except Exception as e:
-        _write_job(job_id, {"status": "failed", "details": str(e)})
+        _write_job(job_id, {"status": JobStatus.FAILED, "details": str(e)})
         logging.error(f"Job {job_id}: Failed - {str(e)}")
 
 
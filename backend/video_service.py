@@ -1,6 +1,6 @@
 import os
 import ffmpeg
-import tempfile
+import functools
 from typing import List, Tuple
 import logging
 from google.cloud.video import transcoder_v1
@@ -9,6 +9,15 @@ from google.cloud.video.transcoder_v1.services.transcoder_service import (
 )
 
 
+@functools.lru_cache(maxsize=None)
+def get_transcoder_client() -> TranscoderServiceClient:
+    """
+    Returns a process-wide Transcoder API client.
+    Building one resolves credentials and opens a gRPC channel, so jobs share it.
+    """
+    return TranscoderServiceClient()
+
+
 def get_video_duration(video_path: str) -> Tuple[float, str]:
     """
     Gets the duration of a video file in seconds using ffmpeg-python.
@@ -37,26 +46,33 @@ def get_video_duration(video_path: str) -> Tuple[float, str]:
 
 import gcs_service
 
+# Number of probed GCS video durations kept in memory
+DURATION_CACHE_MAX_ENTRIES = 1024
+
+
+@functools.lru_cache(maxsize=DURATION_CACHE_MAX_ENTRIES)
+def _probe_gcs_video_duration(bucket_name: str, blob_name: str, generation: int) -> float:
+    # Errors are raised rather than returned so that failed probes are not cached
+    signed_url, error = gcs_service.generate_signed_url(bucket_name, blob_name)
+    if error:
+        raise RuntimeError(error)
+    duration, error = get_video_duration(signed_url)
+    if error:
+        raise RuntimeError(error)
+    return duration
+
+
 def get_video_duration_from_gcs(bucket_name: str, blob_name: str) -> Tuple[float, str]:
     """
-    Gets the duration of a video in GCS by reading only the beginning of the file.
-    This avoids downloading the entire video file.
+    Gets the duration of a video in GCS without downloading it.
+    ffprobe reads the file through a signed URL, and results are cached per object
+    generation, so processing the same video again only costs a metadata lookup.
     """
     try:
-        storage_client = gcs_service.get_storage_client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-
-        # Download the first 1MB of the file, which should contain the header
-        # for most video formats.
-        video_header_bytes = blob.download_as_bytes(start=0, end=1024 * 1024)
-
-        # Use a temporary file to pass the header to ffprobe
-        with tempfile.NamedTemporaryFile() as tmp:
-            tmp.write(video_header_bytes)
-            tmp.flush()  # Ensure all data is written to the file
-            return get_video_duration(tmp.name)
-
+        blob = gcs_service.get_storage_client().bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            return 0.0, f"Video gs://{bucket_name}/{blob_name} does not exist."
+        return _probe_gcs_video_duration(bucket_name, blob_name, blob.generation), ""
     except Exception as e:
         error_msg = f"Unexpected error getting duration from GCS for gs://{bucket_name}/{blob_name}: {e}"
         logging.error(error_msg)
@@ -225,7 +241,7 @@ def join_videos_transcoder(
         return "", "No clip URIs provided for joining."
 
     try:
-        client = TranscoderServiceClient()
+        client = get_transcoder_client()
         parent = f"projects/{project_id}/locations/{location}"
 
         inputs = [
@@ -8,6 +8,7 @@ load_dotenv()
 
 from config import load_config
 from localization import LANGUAGES, load_translation, get_translator
+from utils import clear_gcs_listing_cache, get_api_session, API_TIMEOUT
 
 # --- App Configuration ---
 st.set_page_config(layout="wide")
@@ -40,6 +41,7 @@ def render_main_app():
         st.rerun()
 
     if st.sidebar.button(t("refresh_button"), use_container_width=True, icon=":material/refresh:"):
+        clear_gcs_listing_cache()
         st.rerun()
 
     page_1 = st.Page("pages/1_video_split.py", title="Video Split", icon=":material/split_scene:")
@@ -64,7 +66,9 @@ def render_workspace_management():
 
     try:
         # Fetch existing workspaces
-        response = requests.get(f"{api_url}/workspaces/", params={"gcs_bucket": bucket_name})
+        response = get_api_session().get(
+            f"{api_url}/workspaces/", params={"gcs_bucket": bucket_name}, timeout=API_TIMEOUT
+        )
         response.raise_for_status()
         workspaces = response.json().get("workspaces", [])
 
@@ -93,8 +97,10 @@ def render_workspace_management():
     if st.button(t("create_enter_workspace_button")):
         if new_workspace_name:
             try:
-                response = requests.post(
-                    f"{api_url}/workspaces/", params={"workspace_name": new_workspace_name, "gcs_bucket": bucket_name}
+                response = get_api_session().post(
+                    f"{api_url}/workspaces/",
+                    params={"workspace_name": new_workspace_name, "gcs_bucket": bucket_name},
+                    timeout=API_TIMEOUT,
                 )
                 response.raise_for_status()
                 st.session_state.workspace = new_workspace_name
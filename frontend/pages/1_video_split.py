@@ -1,13 +1,29 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import os
+import html
+import json
 import requests
 import time
-from utils import poll_job_status
+from utils import poll_job_status, JobStatus, get_api_session, API_TIMEOUT, init_session_state
+from utils import get_gcs_files, clear_gcs_listing_cache
 from localization import get_translator
 
+_SESSION_DEFAULTS = {
+    "split_job_id": None,
+    "split_job_status": None,
+    "split_job_details": "",
+}
 
-def gcs_direct_uploader(api_base_url: str, gcs_bucket: str, workspace: str):
+# Workspace folder that direct uploads are written to
+UPLOADS_FOLDER = "uploads/"
+
+# The selectbox shows at most this many uploads, so reruns do not send every option
+# to the browser; a name filter reaches the rest
+VIDEO_SELECT_MAX_OPTIONS = 200
+
+
+def gcs_direct_uploader(api_base_url: str, gcs_bucket: str, workspace: str, refresh_hint: str):
     """
     Renders a custom Streamlit component for direct-to-GCS file uploads.
     The component handles file selection and upload on the client-side and
@@ -17,10 +33,12 @@ def gcs_direct_uploader(api_base_url: str, gcs_bucket: str, workspace: str):
         api_base_url: The base URL of the backend API to get the signed URL.
         gcs_bucket: The GCS bucket to upload the file to.
         workspace: The workspace name to be passed to the backend.
+        refresh_hint: Message shown after a successful upload on how to see the new video.
 
     Returns:
         A dictionary with upload details if successful, otherwise None.
     """
+    refresh_hint_js = json.dumps(html.escape(refresh_hint))
     html_template = f"""
     <!DOCTYPE html>
     <html>
@@ -145,7 +163,7 @@ def gcs_direct_uploader(api_base_url: str, gcs_bucket: str, workspace: str):
                     throw new Error(`Upload failed: ${{uploadResponse.status}} ${{errorText}}`);
                 }}
 
-                statusDiv.innerHTML = `✅ Upload successful! <br>File: gs://${{gcsBucket}}/${{gcs_blob_name}}. Refresh the page to see your uploaded video`;
+                statusDiv.innerHTML = `✅ Upload successful! <br>File: gs://${{gcsBucket}}/${{gcs_blob_name}}.<br>` + {refresh_hint_js};
                 
                 // 3. Send the GCS blob name back to the Streamlit app
                 setComponentValue(JSON.stringify({{ "gcs_blob_name": gcs_blob_name, "file_name": file.name }}));
@@ -182,17 +200,8 @@ def gcs_direct_uploader(api_base_url: str, gcs_bucket: str, workspace: str):
 
 
 def get_uploaded_videos(bucket_name, workspace):
-
-    uploads_prefix = os.path.join(workspace, "uploads/")
-    api_url = f"{st.session_state.API_BASE_URL}/gcs/list"
-    params = {"gcs_bucket": bucket_name, "prefix": uploads_prefix}
-    try:
-        response = requests.get(api_url, params=params)
-        response.raise_for_status()
-        blob_names = response.json().get("files", [])
-    except:
-        blob_names = []
-    return blob_names
+    """Lists uploaded videos through the shared, briefly cached GCS listing."""
+    return get_gcs_files(bucket_name, os.path.join(workspace, UPLOADS_FOLDER))
 
 
 
@@ -210,19 +219,31 @@ else:
 
 st.subheader(t("upload_video_subheader"))
 gcs_direct_uploader(
-    api_base_url=st.session_state.API_BASE_URL, gcs_bucket=gcs_bucket, workspace=st.session_state.workspace
+    api_base_url=st.session_state.API_BASE_URL,
+    gcs_bucket=gcs_bucket,
+    workspace=st.session_state.workspace,
+    refresh_hint=t("upload_refresh_hint"),
 )
 
 st.subheader(t("select_video_to_split_subheader"))
-gcs_blob_name = st.selectbox(t("select_video_label"), get_uploaded_videos(gcs_bucket, workspace))
+# Uploads go straight from the browser to GCS, so the cached listing is only
+# refreshed on request
+if st.button(t("refresh_video_list_button"), icon=":material/refresh:"):
+    clear_gcs_listing_cache(gcs_bucket, os.path.join(workspace, UPLOADS_FOLDER))
+    st.rerun()
+if len(uploaded_videos) > VIDEO_SELECT_MAX_OPTIONS:
+    video_name_filter = st.text_input(t("filter_videos_label")).strip().lower()
+    matching_videos = [video for video in uploaded_videos if video_name_filter in video.lower()]
+    # Upload names start with a UTC timestamp, so the newest are at the end of the listing
+    video_options = matching_videos[-VIDEO_SELECT_MAX_OPTIONS:][::-1]
+    if len(matching_videos) > VIDEO_SELECT_MAX_OPTIONS:
+        st.caption(t("video_options_truncated_caption").format(shown=VIDEO_SELECT_MAX_OPTIONS, total=len(matching_videos)))
+else:
+    video_options = uploaded_videos
+gcs_blob_name = st.selectbox(t("select_video_label"), video_options)
 
 # Initialize session state variables for splitting job
-if "split_job_id" not in st.session_state:
-    st.session_state.split_job_id = None
-if "split_job_status" not in st.session_state:
-    st.session_state.split_job_status = None
-if "split_job_details" not in st.session_state:
-    st.session_state.split_job_details = ""
+init_session_state(_SESSION_DEFAULTS)
 
 segment_duration_min = st.number_input(
     t("max_duration_label"), min_value=1, value=5, step=1, key="segment_duration_input"
@@ -242,12 +263,12 @@ if st.sidebar.button(t("start_splitting_button"), key="start_split_job_button",
                 "gcs_blob_name": gcs_blob_name,
                 "segment_duration": segment_duration_min * 60,
             }
-            split_response = requests.post(split_url, json=payload)
+            split_response = get_api_session().post(split_url, json=payload, timeout=API_TIMEOUT)
             split_response.raise_for_status()
 
             split_data = split_response.json()
             st.session_state.split_job_id = split_data.get("job_id")
-            st.session_state.split_job_status = "pending"
+            st.session_state.split_job_status = JobStatus.PENDING
             st.success(t("backend_job_start_success").format(job_id=st.session_state.split_job_id))
             st.info(t("background_processing_info"))
 
@@ -257,10 +278,10 @@ if st.sidebar.button(t("start_splitting_button"), key="start_split_job_button",
             error_message += f" - {e.response.text}"
         st.error(error_message)
         st.session_state.split_job_id = None
+        st.session_state.split_job_status = None
 
 # --- Job Status Polling ---
-if st.session_state.get("split_job_id"):
+if st.session_state.get("split_job_status"):
     st.markdown("---")
     st.subheader(t("processing_status_subheader"))
-    poll_job_status(st.session_state.split_job_id)
-    st.session_state.split_job_id = None # Clear job so we can start another
+    poll_job_status("split", output_prefix=os.path.join(workspace, "segments/"))
@@ -1,65 +1,88 @@
 import streamlit as st
 import os
+import pathlib
 import time
 import requests
 import json
 import pandas as pd
-from utils import get_gcs_files
-from utils import poll_job_status
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from utils import get_gcs_files, clear_gcs_listing_cache, get_api_session, API_TIMEOUT, uri_widget_key
+from utils import post_compressed_json, parse_gcs_uri, render_dataframe_preview
+from utils import poll_job_status, JobStatus, init_session_state
 from localization import get_translator
 
 # Define the base URL for the backend API
 
-# It's good to define it here so render_tab2 can use it as a default
-# for st.session_state.batch_prompt_text_area_content
-default_prompt_template = """
-You are a professional film and drama editor AI, equipped with multimodal understanding (visuals, dialogue, sound, and inferred emotion). Your task is to meticulously analyze the provided video content from a drama series.** Your goal is to identify multiple key moments suitable for constructing a dynamic and engaging 2-minute trailer from **this specific clip.**
-
-For each potential trailer moment you identify **within this video clip**, extract and structure the metadata. Be precise and insightful.
-
-**Input to Analyze:**
-*   **Primary:** The video content of the drama clip named **`{{source_filename}}`**. This clip is **`{{actual_video_duration}}`** long. Make sure you only capture scenes within the actual length of *this specific video clip*.
-*   **Supplementary (if provided):** A transcript or scene-by-scene description. Your analysis should prioritize what is seen and heard in the video, using supplementary text to clarify or confirm dialogue and scene context if available.
-
-**Prioritize Moments That:**
-*   Introduce key characters effectively.
-*   Establish the central conflict or mystery.
-*   Contain strong emotional beats (joy, sorrow, anger, fear).
-*   Feature visually compelling cinematography or action.
-*   Include memorable or impactful lines of dialogue.
-*   Create suspense or a cliffhanger.
-*   Hint at a major plot twist or reveal.
-
-**Your Task:**
-Based on the video content and the prioritization criteria, identify the best moments and generate the corresponding metadata for each. The output format is handled by a JSON schema, so you only need to focus on the content of the analysis.
-
-**CRITICAL GUARDRAIL:** The `timestamp_start_end` value is the most important field. It **MUST** be accurate. The end time of the clip cannot exceed the `actual_video_duration` of **`{{actual_video_duration}}`**. Any timestamp generated beyond this duration is invalid and will be discarded. Double-check your generated timestamps against the video's length before finalizing the output.
-
-**Output Language:** Please generate the output in **{{language}}**.
-"""
-
-def toggle_video(video_uri):
-    """Callback function to handle video checkbox state changes"""
-    # Check the actual checkbox state from session_state
-    checkbox_key = f"tab2_checkbox_{video_uri}"
-    is_checked = st.session_state.get(checkbox_key, False)
-    
-    # Update the video selection state
-    st.session_state.video_selection[video_uri] = is_checked
-
-@st.cache_data
-def load_metadata_content_tab2(gcs_bucket_name, gcs_blob_name):
-    """Downloads and parses a metadata JSON file from GCS, with caching."""
+# The default prompt lives in a text file so it can be edited without touching code
+PROMPTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "prompts"
+
+
+# Page scripts are re-executed on every rerun, so the file is cached with
+# st.cache_resource rather than functools.lru_cache to persist across runs
+@st.cache_resource(show_spinner=False)
+def _default_prompt():
+    """Loads the default metadata prompt template once per process."""
+    return (PROMPTS_DIR / "trailer_metadata.md").read_text(encoding="utf-8")
+
+
+_SESSION_DEFAULTS = {
+    "metadata_job_id": None,
+    "metadata_job_status": None,
+    "metadata_job_details": "",
+    # Kept outside the text area's key, which Streamlit drops whenever the widget is not rendered
+    "user_prompt_value": "",
+    "batch_progress_bar_placeholder": None,
+    "generated_metadata_files": [],
+    # Only the selected URIs are stored; absence means not selected
+    "video_selection": set(),
+    # URIs the selection table starts out ticked; Select/Deselect All and listing changes
+    # replace it and reset the table's row-index edits
+    "segment_table_seed": set(),
+    "segment_table_listing": (),
+}
+
+@st.cache_data(max_entries=64, ttl=3600, show_spinner=False)
+def load_metadata_content_tab2(api_base_url, gcs_bucket_name, gcs_blob_name):
+    """Downloads a metadata JSON file from GCS and returns it as a DataFrame, with caching."""
     try:
-        api_url = f"{st.session_state.API_BASE_URL}/gcs/download/{gcs_blob_name}"
+        api_url = f"{api_base_url}/gcs/download/{gcs_blob_name}"
         params = {"gcs_bucket": gcs_bucket_name}
-        response = requests.get(api_url, params=params)
+        response = get_api_session().get(api_url, params=params, timeout=API_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        # The table is built once here rather than from the parsed JSON on every rerun
+        return pd.DataFrame(response.json())
     except requests.exceptions.RequestException as e:
         raise Exception(f"Failed to download {gcs_blob_name}. Error: {e}")
 
 
+def store_user_prompt():
+    """on_change callback: copies the prompt out of the widget so it survives page changes."""
+    st.session_state.user_prompt_value = st.session_state.user_prompt
+
+
+def load_all_metadata(gcs_uris):
+    """on_click callback: downloads all generated metadata files in parallel and shows them."""
+    api_base_url = st.session_state.API_BASE_URL
+    ctx = get_script_run_ctx()
+
+    def _prefetch(gcs_uri):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            bucket_name, blob_name = parse_gcs_uri(gcs_uri)
+            load_metadata_content_tab2(api_base_url, bucket_name, blob_name)
+        except Exception:
+            pass  # The error is reported when the file is rendered
+
+    # Downloads are I/O bound, so a thread pool only warms the cache concurrently
+    with ThreadPoolExecutor(max_workers=min(16, len(gcs_uris))) as executor:
+        list(executor.map(_prefetch, gcs_uris))
+
+    for gcs_uri in gcs_uris:
+        st.session_state[uri_widget_key("show_metadata", gcs_uri)] = True
+
+
 # --- Render Metadata Generation Page ---
 t = get_translator()
 gcs_bucket_name = st.session_state.GCS_BUCKET_NAME
@@ -70,22 +93,7 @@ metadata_output_prefix = st.session_state.GCS_METADATA_PREFIX
 # st.header(t("step2_header").format(bucket_name=gcs_bucket_name, prefix=segments_prefix))
 
 # Initialize session state
-if "metadata_job_id" not in st.session_state:
-    st.session_state.metadata_job_id = None
-if "metadata_job_status" not in st.session_state:
-    st.session_state.metadata_job_status = None
-if "metadata_job_details" not in st.session_state:
-    st.session_state.metadata_job_details = ""
-if "batch_prompt_text_area_content" not in st.session_state:
-    st.session_state.batch_prompt_text_area_content = default_prompt_template
-if "user_prompt" not in st.session_state:
-    st.session_state.user_prompt = ""
-if "batch_progress_bar_placeholder" not in st.session_state:
-    st.session_state.batch_progress_bar_placeholder = None
-if "generated_metadata_files" not in st.session_state:
-    st.session_state.generated_metadata_files = []
-if "viewed_metadata_content" not in st.session_state:
-    st.session_state.viewed_metadata_content = {}
+init_session_state(_SESSION_DEFAULTS)
 
 # --- GCS File Listing ---
 gcs_video_uris = []
@@ -94,6 +102,11 @@ if not gcs_bucket_name:
 else:
     blob_names = get_gcs_files(gcs_bucket_name, segments_prefix)
     gcs_video_uris = [f"gs://{gcs_bucket_name}/{name}" for name in blob_names]
+    # Display names are kept for the current listing only and rebuilt when it changes,
+    # so the memo never outgrows one folder listing
+    if st.session_state.get("_basenames_listing") != tuple(gcs_video_uris):
+        st.session_state._basenames_listing = tuple(gcs_video_uris)
+        st.session_state._basenames = {uri: uri.rsplit("/", 1)[-1] for uri in gcs_video_uris}
 
     if not gcs_video_uris:
         st.warning(t("no_video_segments_warning").format(bucket_name=gcs_bucket_name, prefix=segments_prefix))
@@ -102,38 +115,19 @@ if gcs_video_uris:
     st.info(t("select_videos_for_metadata_label"), icon=":material/info:")
     # st.success(t("found_video_segments_success").format(count=len(gcs_video_uris)))
 
-    # Initialize or update selection state
-    if 'video_selection' not in st.session_state:
-        st.session_state.video_selection = {}
-
-    # Update state for current list of videos, preserving existing selections
-    current_selection = st.session_state.video_selection.copy()
-    st.session_state.video_selection = {uri: current_selection.get(uri, False) for uri in gcs_video_uris}
-    
-    # Clear checkbox states for videos that are no longer in the list
-    for key in list(st.session_state.keys()):
-        if key.startswith("tab2_checkbox_") and key not in [f"tab2_checkbox_{uri}" for uri in gcs_video_uris]:
-            del st.session_state[key]
-
     # --- Selection Controls ---
     col1, col2, col3 = st.columns(3, gap="large")
     with col1:
         if st.button(t("select_all_button"), key="select_all_videos", use_container_width=True, icon=":material/check_circle:"):
-            for uri in gcs_video_uris:
-                st.session_state.video_selection[uri] = True
-                # Update checkbox state
-                st.session_state[f"tab2_checkbox_{uri}"] = True
-            st.rerun()
+            st.session_state.segment_table_seed = set(gcs_video_uris)
+            st.session_state.pop("segment_table", None)
     with col2:
         if st.button(t("deselect_all_button"), key="deselect_all_videos", use_container_width=True, icon=":material/close:"):
-            for uri in gcs_video_uris:
-                st.session_state.video_selection[uri] = False
-                # Update checkbox state
-                st.session_state[f"tab2_checkbox_{uri}"] = False
-            st.rerun()
+            st.session_state.segment_table_seed = set()
+            st.session_state.pop("segment_table", None)
     with col3:
         if st.button(t("delete_selected_button"), key="delete_selected_videos", use_container_width=True, icon=":material/delete:"):
-            selected_videos_to_delete = [uri for uri, selected in st.session_state.video_selection.items() if selected]
+            selected_videos_to_delete = [uri for uri in gcs_video_uris if uri in st.session_state.video_selection]
             if not selected_videos_to_delete:
                 st.warning(t("no_videos_selected_for_deletion_warning"))
             else:
@@ -146,19 +140,20 @@ if gcs_video_uris:
                         "gcs_bucket": gcs_bucket_name,
                         "blob_names": blob_names_to_delete
                     }
-                    response = requests.post(api_url, json=payload)
+                    response = get_api_session().post(api_url, json=payload, timeout=API_TIMEOUT)
                     response.raise_for_status() # Will raise an exception for 4xx/5xx errors
+                    data = response.json()
+
+                    deleted_files = data.get("deleted_files", [])
+                    if deleted_files:
+                        st.success(t("delete_success_message").format(count=len(deleted_files)))
+                    for blob_name, error in data.get("failed_files", {}).items():
+                        st.error(t("delete_clip_fail").format(filename=os.path.basename(blob_name), error=error))
+                    clear_gcs_listing_cache()
                     
-                    st.success(t("delete_success_message").format(count=len(blob_names_to_delete)))
-                    
-                    # Unselect the deleted files from the UI and clear checkbox states
-                    for uri in selected_videos_to_delete:
-                        if uri in st.session_state.video_selection:
-                            st.session_state.video_selection[uri] = False
-                        # Clear checkbox state
-                        checkbox_key = f"tab2_checkbox_{uri}"
-                        if checkbox_key in st.session_state:
-                            st.session_state[checkbox_key] = False
+                    # Reset the selection table for the new listing
+                    st.session_state.segment_table_seed = set()
+                    st.session_state.pop("segment_table", None)
                     
                     st.rerun()
 
@@ -167,28 +162,47 @@ if gcs_video_uris:
                 except Exception as e:
                     st.error(t("unexpected_error").format(e=e))
 
-    # --- Video List with Checkboxes ---
-    for uri in gcs_video_uris:
-        # The key must be unique, so we use the uri itself
-        st.checkbox(
-            os.path.basename(uri),
-            key=f"tab2_checkbox_{uri}",
-            on_change=toggle_video,
-            args=(uri,)
-        )
+    # --- Video Selection Table ---
+    # The editor records ticks by row index, so when the listing changes its edits are
+    # dropped and the table is re-seeded from the URIs that were selected
+    listing = tuple(gcs_video_uris)
+    if st.session_state.segment_table_listing != listing:
+        st.session_state.segment_table_listing = listing
+        st.session_state.segment_table_seed = st.session_state.video_selection & set(listing)
+        st.session_state.pop("segment_table", None)
+
+    # A single data_editor replaces one checkbox widget per segment
+    selection_df = pd.DataFrame({
+        "selected": [uri in st.session_state.segment_table_seed for uri in gcs_video_uris],
+        "file": [st.session_state._basenames[uri] for uri in gcs_video_uris],
+        "uri": gcs_video_uris,
+    })
+    edited_df = st.data_editor(
+        selection_df,
+        column_config={
+            "selected": st.column_config.CheckboxColumn(t("selected_column")),
+            "file": t("file_column"),
+            "uri": None,
+        },
+        disabled=["file", "uri"],
+        hide_index=True,
+        use_container_width=True,
+        key="segment_table",
+    )
+    st.session_state.video_selection = set(edited_df["uri"][edited_df["selected"]])
 
     # --- Prompt and Generate Button ---
+    st.session_state.user_prompt = st.session_state.user_prompt_value
     st.text_area(
         t("user_prompt_label"),
-        value=st.session_state.user_prompt,
         height=100,
-        key="user_prompt_widget",
-        on_change=lambda: setattr(st.session_state, 'user_prompt', st.session_state.user_prompt_widget),
-        help=t("user_prompt_help")
+        key="user_prompt",
+        help=t("user_prompt_help"),
+        on_change=store_user_prompt,
     )
 
     if st.sidebar.button(t("generate_metadata_button"), key="batch_process_gemini_button_gcs", use_container_width=True, type="primary", icon=":material/movie_info:"):
-        selected_videos = [uri for uri, selected in st.session_state.video_selection.items() if selected]
+        selected_videos = [uri for uri in gcs_video_uris if uri in st.session_state.video_selection]
         
         if not selected_videos:
             st.warning(t("no_videos_selected_warning"))
@@ -198,11 +212,11 @@ if gcs_video_uris:
         st.session_state.metadata_job_status = "starting"
         st.session_state.metadata_job_details = "Initializing job..."
         st.session_state.generated_metadata_files = [] # Clear previous results
-        st.session_state.viewed_metadata_content = {}
 
         try:
             api_url = f"{st.session_state.API_BASE_URL}/generate-metadata/"
-            prompt_with_user_input = st.session_state.batch_prompt_text_area_content + "\n\n" + st.session_state.user_prompt
+            # The prompt is a string.Template, so "$" in the user's text is escaped to stay literal
+            prompt_with_user_input = _default_prompt() + "\n\n" + st.session_state.user_prompt_value.replace("$", "$$")
             
             # Get the current language from the session state, which is set in app.py
             language = st.session_state.get("selected_language", "English")
@@ -216,43 +230,52 @@ if gcs_video_uris:
                 "gcs_output_prefix": metadata_output_prefix,
                 "language": language
             }
-            response = requests.post(api_url, json=payload)
+            response = post_compressed_json(api_url, payload)
             response.raise_for_status()
             
             data = response.json()
             st.session_state.metadata_job_id = data.get("job_id")
-            st.session_state.metadata_job_status = "pending"
+            st.session_state.metadata_job_status = JobStatus.PENDING
             st.success(t("backend_job_start_success").format(job_id=st.session_state.metadata_job_id))
 
         except requests.exceptions.RequestException as e:
             st.error(t("metadata_job_start_error").format(e=e))
             st.session_state.metadata_job_id = None
+            st.session_state.metadata_job_status = None
 
 # --- Job Status Polling ---
-if st.session_state.get("metadata_job_id"):
+if st.session_state.get("metadata_job_status"):
     st.markdown("---")
     st.subheader(t("processing_status_subheader"))
-    poll_job_status(st.session_state.metadata_job_id)
-    st.session_state.metadata_job_id = None # Clear job
-    st.rerun()
+    poll_job_status("metadata", output_prefix=os.path.join(workspace, metadata_output_prefix))
 
 if st.session_state.get("generated_metadata_files"):
     st.markdown("---")
     st.subheader(t("generated_metadata_files_subheader"))
 
     for gcs_uri in st.session_state.generated_metadata_files:
-        file_basename = os.path.basename(gcs_uri)
+        file_basename = gcs_uri.rsplit("/", 1)[-1]
         with st.expander(t("view_metadata_expander").format(filename=file_basename)):
+            # Expander bodies are sent to the browser even when collapsed, so the
+            # content is only downloaded and rendered once the user asks for it
+            if not st.toggle(t("show_metadata_toggle"), key=uri_widget_key("show_metadata", gcs_uri)):
+                continue
             try:
-                gcs_path_str = gcs_uri.split("gs://")[1]
-                gcs_bucket_name, gcs_blob_name = gcs_path_str.split('/', 1)
-                metadata_content = load_metadata_content_tab2(gcs_bucket_name, gcs_blob_name)
-                df = pd.DataFrame(metadata_content)
-                st.dataframe(df)
+                metadata_bucket, metadata_blob = parse_gcs_uri(gcs_uri)
+                render_dataframe_preview(
+                    load_metadata_content_tab2(st.session_state.API_BASE_URL, metadata_bucket, metadata_blob),
+                    t("metadata_preview_truncated_caption"),
+                )
             except Exception as e:
                 st.error(t("load_metadata_error").format(filename=file_basename, e=e))
 
+    st.button(
+        t("load_all_metadata_button"),
+        key="load_all_metadata_button",
+        on_click=load_all_metadata,
+        args=(st.session_state.generated_metadata_files,),
+    )
     if st.button(t("clear_results_button"), key="clear_metadata_results_button"):
         st.session_state.generated_metadata_files = []
-        st.session_state.viewed_metadata_content = {}
+        load_metadata_content_tab2.clear()
         st.rerun()
\ No newline at end of file
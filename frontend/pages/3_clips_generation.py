@@ -2,37 +2,55 @@ import streamlit as st
 import os
 import requests
 import pandas as pd
-from utils import poll_job_status
+from collections import OrderedDict
+from utils import poll_job_status, JobStatus, uri_widget_key, init_session_state, sync_uri_selection
+from utils import get_gcs_files, clear_gcs_listing_cache, get_api_session, API_TIMEOUT, get_signed_urls
+from utils import render_lazy_video, VIDEO_GRID_COLUMNS, render_dataframe_preview
 from localization import get_translator
 
 # Define the base URL for the backend API
 
+# Maximum number of parsed metadata files kept in the per-session cache
+METADATA_CACHE_MAX_ENTRIES = 64
+
+_SESSION_DEFAULTS = {
+    "clips_job_id": None,
+    "clips_job_status": None,
+    "clips_job_details": "",
+    "generated_clips_list": [],
+}
+
 def toggle_metadata(metadata_uri):
     """Callback function to handle metadata checkbox state changes"""
     # Check the actual checkbox state from session_state
-    checkbox_key = f"tab3_checkbox_{metadata_uri}"
+    checkbox_key = uri_widget_key("tab3_checkbox", metadata_uri)
     is_checked = st.session_state.get(checkbox_key, False)
     
     # Update the metadata selection state
     st.session_state.metadata_selection[metadata_uri] = is_checked
 
 def load_metadata_content(gcs_bucket_name, gcs_blob_name):
-    """Downloads and parses a metadata JSON file from GCS, with caching."""
-    # Use session_state for manual caching
-    if "metadata_cache" not in st.session_state:
-        st.session_state.metadata_cache = {}
+    """Downloads a metadata JSON file from GCS and returns it as a DataFrame, with caching."""
+    # Use session_state for manual caching, bounded so long sessions don't
+    # accumulate every metadata file ever viewed
+    metadata_cache = st.session_state.setdefault("metadata_cache", OrderedDict())
 
-    if gcs_blob_name in st.session_state.metadata_cache:
-        return st.session_state.metadata_cache[gcs_blob_name]
+    if gcs_blob_name in metadata_cache:
+        metadata_cache.move_to_end(gcs_blob_name)
+        return metadata_cache[gcs_blob_name]
 
     try:
         # The new endpoint includes the blob name in the path, which avoids encoding issues.
         api_url = f"{st.session_state.API_BASE_URL}/gcs/download/{gcs_blob_name}"
         params = {"gcs_bucket": gcs_bucket_name}
-        response = requests.get(api_url, params=params)
+        response = get_api_session().get(api_url, params=params, timeout=API_TIMEOUT)
         response.raise_for_status()
-        content = response.json()
-        st.session_state.metadata_cache[gcs_blob_name] = content
+        # The table is cached rather than the raw JSON so reruns skip rebuilding it
+        content = pd.DataFrame(response.json())
+        metadata_cache[gcs_blob_name] = content
+        if len(metadata_cache) > METADATA_CACHE_MAX_ENTRIES:
+            # Evict the least recently viewed file
+            metadata_cache.popitem(last=False)
         return content
     except requests.exceptions.RequestException as e:
         raise Exception(f"Failed to download {gcs_blob_name}. Error: {e}")
@@ -48,14 +66,7 @@ clips_output_prefix = st.session_state.GCS_OUTPUT_CLIPS_PREFIX
 # st.header(t("step3_header"))
 
 # Initialize session state
-if "clips_job_id" not in st.session_state:
-    st.session_state.clips_job_id = None
-if "clips_job_status" not in st.session_state:
-    st.session_state.clips_job_status = None
-if "clips_job_details" not in st.session_state:
-    st.session_state.clips_job_details = ""
-if "generated_clips_list" not in st.session_state:
-    st.session_state.generated_clips_list = []
+init_session_state(_SESSION_DEFAULTS)
 
 # --- GCS Metadata File Listing ---
 st.info(t("choose_metadata_for_clips_label"), icon=":material/info:")
@@ -63,30 +74,16 @@ st.info(t("choose_metadata_for_clips_label"), icon=":material/info:")
 gcs_metadata_files = []
 
 if gcs_bucket_name:
-    try:
-        api_url = f"{st.session_state.API_BASE_URL}/gcs/list"
-        params = {"gcs_bucket": gcs_bucket_name, "prefix": metadata_gcs_prefix}
-        response = requests.get(api_url, params=params)
-        response.raise_for_status()
-        gcs_metadata_files = response.json().get("files", [])
-    except requests.exceptions.RequestException as e:
-        gcs_metadata_files = []
+    gcs_metadata_files = get_gcs_files(gcs_bucket_name, metadata_gcs_prefix)
 
 if not gcs_metadata_files:
     st.warning(t("no_metadata_files_warning").format(bucket_name=gcs_bucket_name, prefix=metadata_gcs_prefix))
     st.stop()
 
-# Initialize or update selection state
-if 'metadata_selection' not in st.session_state:
-    st.session_state.metadata_selection = {}
+# (uri, display name) pairs are computed once and reused by the list below
+metadata_entries = [(uri, uri.rsplit("/", 1)[-1]) for uri in gcs_metadata_files]
 
-current_selection = st.session_state.metadata_selection.copy()
-st.session_state.metadata_selection = {uri: current_selection.get(uri, False) for uri in gcs_metadata_files}
-
-# Clear checkbox states for metadata files that are no longer in the list
-for key in list(st.session_state.keys()):
-    if key.startswith("tab3_checkbox_") and key not in [f"tab3_checkbox_{uri}" for uri in gcs_metadata_files]:
-        del st.session_state[key]
+metadata_selection = sync_uri_selection("metadata_selection", "tab3_checkbox", gcs_metadata_files)
 
 # --- Selection Controls ---
 col1, col2, col3 = st.columns(3, gap="large")
@@ -95,15 +92,13 @@ with col1:
         for uri in gcs_metadata_files:
             st.session_state.metadata_selection[uri] = True
             # Update checkbox state
-            st.session_state[f"tab3_checkbox_{uri}"] = True
-        st.rerun()
+            st.session_state[uri_widget_key("tab3_checkbox", uri)] = True
 with col2:
     if st.button(t("deselect_all_button"), key="deselect_all_metadata", use_container_width=True, icon=":material/close:"):
         for uri in gcs_metadata_files:
             st.session_state.metadata_selection[uri] = False
             # Update checkbox state
-            st.session_state[f"tab3_checkbox_{uri}"] = False
-        st.rerun()
+            st.session_state[uri_widget_key("tab3_checkbox", uri)] = False
 with col3:
     if st.button(t("delete_selected_button"), key="delete_selected_metadata", use_container_width=True, icon=":material/delete:"):
         selected_metadata_to_delete = [uri for uri, selected in st.session_state.metadata_selection.items() if selected]
@@ -116,11 +111,12 @@ with col3:
                     "gcs_bucket": gcs_bucket_name,
                     "blob_names": selected_metadata_to_delete
                 }
-                response = requests.post(api_url, json=payload)
+                response = get_api_session().post(api_url, json=payload, timeout=API_TIMEOUT)
                 response.raise_for_status()
                 
-                deleted_files = response.json().get("deleted_files", [])
-                failed_files = response.json().get("failed_files", {})
+                data = response.json()
+                deleted_files = data.get("deleted_files", [])
+                failed_files = data.get("failed_files", {})
 
                 if deleted_files:
                     st.success(t("delete_metadata_success").format(count=len(deleted_files)))
@@ -135,7 +131,7 @@ with col3:
                         if uri in st.session_state.metadata_selection:
                             st.session_state.metadata_selection[uri] = False
                         # Clear checkbox state
-                        checkbox_key = f"tab3_checkbox_{uri}"
+                        checkbox_key = uri_widget_key("tab3_checkbox", uri)
                         if checkbox_key in st.session_state:
                             st.session_state[checkbox_key] = False
                 
@@ -143,6 +139,7 @@ with col3:
                     for uri, error in failed_files.items():
                         st.error(t("delete_metadata_fail").format(filename=os.path.basename(uri), error=error))
                 
+                clear_gcs_listing_cache()
                 st.rerun()
 
             except requests.exceptions.RequestException as e:
@@ -151,51 +148,53 @@ with col3:
                 st.error(t("unexpected_error").format(e=e))
 
 # --- Metadata File List with Checkboxes ---
-for uri in gcs_metadata_files:
-    file_basename = os.path.basename(uri)
+for uri, file_basename in metadata_entries:
     with st.expander(file_basename):
         col1, col2 = st.columns([0.8, 0.2])
         with col1:
             st.checkbox(
                 t("select_for_clip_generation_checkbox"),
-                key=f"tab3_checkbox_{uri}",
+                key=uri_widget_key("tab3_checkbox", uri),
                 on_change=toggle_metadata,
                 args=(uri,)
             )
         with col2:
-            if st.button(t("delete_button"), key=f"delete_meta_{uri}", use_container_width=True, icon=":material/delete:"):
+            if st.button(t("delete_button"), key=uri_widget_key("delete_meta", uri), use_container_width=True, icon=":material/delete:"):
                 try:
                     api_url = f"{st.session_state.API_BASE_URL}/delete-gcs-blob/"
                     payload = {
                         "gcs_bucket": gcs_bucket_name,
                         "blob_name": uri
                     }
-                    response = requests.delete(api_url, json=payload)
+                    response = get_api_session().delete(api_url, json=payload, timeout=API_TIMEOUT)
                     response.raise_for_status()
                     st.success(t("delete_metadata_file_success").format(filename=file_basename))
                     # Clear the specific entry from the manual cache
                     if "metadata_cache" in st.session_state and uri in st.session_state.metadata_cache:
                         del st.session_state.metadata_cache[uri]
                     # Clear checkbox state
-                    checkbox_key = f"tab3_checkbox_{uri}"
+                    checkbox_key = uri_widget_key("tab3_checkbox", uri)
                     if checkbox_key in st.session_state:
                         st.session_state[checkbox_key] = False
                     # Clear selection state
                     if uri in st.session_state.metadata_selection:
                         st.session_state.metadata_selection[uri] = False
+                    clear_gcs_listing_cache()
                     st.rerun()
                 except requests.exceptions.RequestException as e:
                     st.error(t("delete_metadata_file_error").format(filename=file_basename, e=e))
 
-        # Display metadata content automatically using the cached function
-        try:
-            metadata_content = load_metadata_content(gcs_bucket_name, uri)
-            df = pd.DataFrame(metadata_content)
-            st.dataframe(df)
-        except Exception as e:
-            st.error(t("load_metadata_error").format(filename=file_basename, e=e))
+        # Expander bodies run even while collapsed, so a file is only downloaded once
+        # its content is asked for
+        if st.toggle(t("show_metadata_content_toggle"), key=uri_widget_key("tab3_preview", uri)):
+            try:
+                render_dataframe_preview(load_metadata_content(gcs_bucket_name, uri), t("metadata_preview_truncated_caption"))
+            except Exception as e:
+                st.error(t("load_metadata_error").format(filename=file_basename, e=e))
 
-selected_metadata_files = [uri for uri, selected in st.session_state.metadata_selection.items() if selected]
+# Only files present in the current listing are submitted, so the backend is never
+# asked for metadata that was deleted since it was selected
+selected_metadata_files = [uri for uri in gcs_metadata_files if metadata_selection.get(uri)]
 
 if selected_metadata_files:
     st.sidebar.info(t("selected_metadata_files_success").format(count=len(selected_metadata_files)))
@@ -206,6 +205,14 @@ if selected_metadata_files:
         key="output_gcs_prefix_tab3"
     )
 
+    encode_profile = st.radio(
+        t("encode_profile_label"),
+        options=["final", "draft"],
+        format_func=lambda profile: t(f"encode_profile_{profile}"),
+        horizontal=True,
+        key="encode_profile_tab3",
+    )
+
     if st.sidebar.button(t("generate_clips_button"), key="generate_clips_button_tab3", use_container_width=True, type="primary", icon=":material/movie:"):
         if not output_gcs_prefix:
             st.warning(t("provide_gcs_prefix_warning"))
@@ -222,27 +229,27 @@ if selected_metadata_files:
                 "workspace": workspace,
                 "gcs_bucket": gcs_bucket_name,
                 "metadata_blob_names": selected_metadata_files,
-                "output_gcs_prefix": output_gcs_prefix
+                "output_gcs_prefix": output_gcs_prefix,
+                "encode_profile": encode_profile,
             }
-            response = requests.post(api_url, json=payload)
+            response = get_api_session().post(api_url, json=payload, timeout=API_TIMEOUT)
             response.raise_for_status()
             
             data = response.json()
             st.session_state.clips_job_id = data.get("job_id")
-            st.session_state.clips_job_status = "pending"
+            st.session_state.clips_job_status = JobStatus.PENDING
             st.success(t("backend_job_start_success").format(job_id=st.session_state.clips_job_id))
 
         except requests.exceptions.RequestException as e:
             st.error(t("clip_generation_job_start_error").format(e=e))
             st.session_state.clips_job_id = None
+            st.session_state.clips_job_status = None
 
 # --- Job Status Polling ---
-if st.session_state.get("clips_job_id"):
+if st.session_state.get("clips_job_status"):
     st.markdown("---")
     st.subheader(t("processing_status_subheader"))
-    poll_job_status(st.session_state.clips_job_id)
-    st.session_state.clips_job_id = None
-    st.rerun()
+    poll_job_status("clips")
 
 # --- Display Generated Clips ---
 if st.session_state.get("generated_clips_list"):
@@ -252,29 +259,19 @@ if st.session_state.get("generated_clips_list"):
     # In a real app, you'd get these from a config or the API
     gcs_bucket_name = st.session_state.GCS_BUCKET_NAME
 
-    for clip_blob_name in st.session_state.generated_clips_list:
-        try:
-            # This assumes gcs_service is available here or we call it differently
-            # For simplicity, let's assume a helper function can be called
-            # In a real app, you might need to adjust how you get the signed URL
-            api_url = f"{st.session_state.API_BASE_URL}/gcs/signed-url"
-            params = {"gcs_bucket": gcs_bucket_name, "blob_name": clip_blob_name}
-            response = requests.get(api_url, params=params)
-            if response.status_code == 200:
-                signed_url = response.json().get("url")
-                error = None
-            else:
-                signed_url = None
-                error = response.text
-            
-            if error:
-                st.error(t("get_clip_url_error").format(filename=os.path.basename(clip_blob_name), error=error))
-            else:
-                st.video(signed_url)
-                st.caption(os.path.basename(clip_blob_name))
-
-        except Exception as e:
-            st.error(t("display_video_error").format(filename=os.path.basename(clip_blob_name), e=e))
+    signed_urls = get_signed_urls(gcs_bucket_name, st.session_state.generated_clips_list)
+    grid = st.columns(VIDEO_GRID_COLUMNS)
+    for i, (clip_blob_name, (signed_url, error)) in enumerate(zip(st.session_state.generated_clips_list, signed_urls)):
+        with grid[i % VIDEO_GRID_COLUMNS]:
+            try:
+                if error:
+                    st.error(t("get_clip_url_error").format(filename=os.path.basename(clip_blob_name), error=error))
+                else:
+                    render_lazy_video(signed_url)
+                    st.caption(os.path.basename(clip_blob_name))
+
+            except Exception as e:
+                st.error(t("display_video_error").format(filename=os.path.basename(clip_blob_name), e=e))
 
     if st.button(t("clear_generated_clips_button"), key="clear_clips_button"):
         st.session_state.generated_clips_list = []
@@ -1,17 +1,18 @@
 import streamlit as st
 import os
 import requests
-from utils import poll_multiple_job_statuses
+from concurrent.futures import ThreadPoolExecutor
+from utils import poll_multiple_job_statuses, JobStatus, uri_widget_key, get_api_session, API_TIMEOUT
+from utils import get_gcs_files, clear_gcs_listing_cache, sync_uri_selection
 from localization import get_translator
 
-def toggle_clip_refine(clip_uri):
-    """Callback function to handle clip refine checkbox state changes"""
-    # Check the actual checkbox state from session_state
-    checkbox_key = f"tab4_checkbox_{clip_uri}"
-    is_checked = st.session_state.get(checkbox_key, False)
-    
-    # Update the clip selection state
-    st.session_state.clip_selection[clip_uri] = is_checked
+# Upper bound on refine job submissions sent to the backend at once
+REFINE_SUBMIT_MAX_WORKERS = 8
+
+def apply_clip_selection(clip_uris):
+    """Form submit callback: copies the submitted checkbox states into the clip selection"""
+    for clip_uri in clip_uris:
+        st.session_state.clip_selection[clip_uri] = st.session_state.get(uri_widget_key("tab4_checkbox", clip_uri), False)
 
 # --- Render Refine Clips Page ---
 t = get_translator()
@@ -24,30 +25,16 @@ clips_gcs_prefix = os.path.join(workspace, "clips/")
 # st.subheader(t("select_clips_subheader").format(bucket_name=gcs_bucket_name, prefix=clips_gcs_prefix))
 st.info(t("select_clips_for_face_recognition_label"), icon=":material/info:")
 # --- GCS Clip Listing ---
-try:
-    api_url = f"{st.session_state.API_BASE_URL}/gcs/list"
-    params = {"gcs_bucket": gcs_bucket_name, "prefix": clips_gcs_prefix}
-    response = requests.get(api_url, params=params)
-    response.raise_for_status()
-    gcs_clips = response.json().get("files", [])
-except requests.exceptions.RequestException as e:
-    gcs_clips = []
+gcs_clips = get_gcs_files(gcs_bucket_name, clips_gcs_prefix)
 
 if not gcs_clips:
     st.warning(t("no_clips_found_warning").format(bucket_name=gcs_bucket_name, prefix=clips_gcs_prefix))
     st.stop()
 
-if 'clip_selection' not in st.session_state:
-    st.session_state.clip_selection = {}
+# Display names are computed once per listing and reused for labels and job entries
+clip_names = {uri: uri.rsplit("/", 1)[-1] for uri in gcs_clips}
 
-# Update state for current list of clips, preserving existing selections
-current_selection = st.session_state.clip_selection.copy()
-st.session_state.clip_selection = {uri: current_selection.get(uri, False) for uri in gcs_clips}
-
-# Clear checkbox states for clips that are no longer in the list
-for key in list(st.session_state.keys()):
-    if key.startswith("tab4_checkbox_") and key not in [f"tab4_checkbox_{uri}" for uri in gcs_clips]:
-        del st.session_state[key]
+sync_uri_selection("clip_selection", "tab4_checkbox", gcs_clips)
 
 # --- Selection Controls ---
 col1, col2, col3 = st.columns(3, gap="large")
@@ -56,15 +43,13 @@ with col1:
         for uri in gcs_clips:
             st.session_state.clip_selection[uri] = True
             # Update checkbox state
-            st.session_state[f"tab4_checkbox_{uri}"] = True
-        st.rerun()
+            st.session_state[uri_widget_key("tab4_checkbox", uri)] = True
 with col2:
     if st.button(t("deselect_all_button"), key="deselect_all_clips_frs", use_container_width=True, icon=":material/close:"):
         for uri in gcs_clips:
             st.session_state.clip_selection[uri] = False
             # Update checkbox state
-            st.session_state[f"tab4_checkbox_{uri}"] = False
-        st.rerun()
+            st.session_state[uri_widget_key("tab4_checkbox", uri)] = False
 with col3:
     if st.button(t("delete_selected_button"), key="delete_selected_clips_frs", use_container_width=True, icon=":material/delete:"):
         selected_clips_to_delete = [uri for uri, selected in st.session_state.clip_selection.items() if selected]
@@ -77,11 +62,12 @@ with col3:
                     "gcs_bucket": gcs_bucket_name,
                     "blob_names": selected_clips_to_delete
                 }
-                response = requests.post(api_url, json=payload)
+                response = get_api_session().post(api_url, json=payload, timeout=API_TIMEOUT)
                 response.raise_for_status()
                 
-                deleted_files = response.json().get("deleted_files", [])
-                failed_files = response.json().get("failed_files", {})
+                data = response.json()
+                deleted_files = data.get("deleted_files", [])
+                failed_files = data.get("failed_files", {})
 
                 if deleted_files:
                     st.success(t("delete_clips_success").format(count=len(deleted_files)))
@@ -90,7 +76,7 @@ with col3:
                         if uri in st.session_state.clip_selection:
                             st.session_state.clip_selection[uri] = False
                         # Clear checkbox state
-                        checkbox_key = f"tab4_checkbox_{uri}"
+                        checkbox_key = uri_widget_key("tab4_checkbox", uri)
                         if checkbox_key in st.session_state:
                             st.session_state[checkbox_key] = False
                 
@@ -98,6 +84,7 @@ with col3:
                     for uri, error in failed_files.items():
                         st.error(t("delete_clip_fail").format(filename=os.path.basename(uri), error=error))
                 
+                clear_gcs_listing_cache()
                 st.rerun()
 
             except requests.exceptions.RequestException as e:
@@ -106,12 +93,18 @@ with col3:
                 st.error(t("unexpected_error").format(e=e))
 
 # --- Clip List with Checkboxes ---
-for uri in gcs_clips:
-    st.checkbox(
-        os.path.basename(uri),
-        key=f"tab4_checkbox_{uri}",
-        on_change=toggle_clip_refine,
-        args=(uri,)
+# Inside a form, ticking a checkbox doesn't rerun the page; the selection is applied once on submit
+with st.form("clip_selection_form"):
+    for uri, clip_name in clip_names.items():
+        st.checkbox(
+            clip_name,
+            key=uri_widget_key("tab4_checkbox", uri),
+        )
+    st.form_submit_button(
+        t("apply_selection_button"),
+        on_click=apply_clip_selection,
+        args=(gcs_clips,),
+        icon=":material/check:",
     )
 
 st.divider()
@@ -141,7 +134,7 @@ if uploaded_cast_photos:
             }
             api_url = f"{st.session_state.API_BASE_URL}/upload-cast-photo"
 
-            response = requests.post(api_url, data=data, files=files)
+            response = get_api_session().post(api_url, data=data, files=files, timeout=API_TIMEOUT)
             response.raise_for_status()
             
             data = response.json()
@@ -161,30 +154,38 @@ if st.sidebar.button(t("refine_clips_by_cast_button"), key="refine_clip_by_face_
         st.warning(t("upload_one_cast_photo_warning"))
         st.stop()
     
-    # Start the face detection and copy job for each selected clip
+    # Start the face detection and copy job for each selected clip. The requests are
+    # sent concurrently; the session is resolved here since the workers have no script context
     st.session_state.refine_jobs = []
-    for clip_uri in selected_clips:
+    api_url = f"{st.session_state.API_BASE_URL}/detect-faces-and-copy/"
+    api_session = get_api_session()
+    base_payload = {
+        "workspace": workspace,
+        "gcs_bucket": gcs_bucket_name,
+        "output_gcs_prefix": os.path.join(workspace, "refined_clips/"),
+        "gcs_cast_photo_uris": st.session_state.uploaded_cast_photo_uris
+    }
+
+    def submit_refine_job(clip_uri):
         try:
-            api_url = f"{st.session_state.API_BASE_URL}/detect-faces-and-copy/"
-            payload = {
-                "workspace": workspace,
-                "gcs_bucket": gcs_bucket_name,
-                "gcs_video_uri": clip_uri,
-                "output_gcs_prefix": os.path.join(workspace, "refined_clips/"),
-                "gcs_cast_photo_uris": st.session_state.uploaded_cast_photo_uris
-            }
-            response = requests.post(api_url, json=payload)
+            response = api_session.post(api_url, json={**base_payload, "gcs_video_uri": clip_uri}, timeout=API_TIMEOUT)
             response.raise_for_status()
-            data = response.json()
-            job_id = data.get("job_id")
-            st.session_state.refine_jobs.append({"job_id": job_id, "clip": os.path.basename(clip_uri), "status": "pending"})
-            st.success(t("backend_job_start_success").format(job_id=job_id))
+            return response.json().get("job_id"), None
         except requests.exceptions.RequestException as e:
-            st.error(t("face_recognition_job_start_error").format(filename=os.path.basename(clip_uri), error=e.response.text if e.response else e))
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(REFINE_SUBMIT_MAX_WORKERS, len(selected_clips)))) as executor:
+        submissions = list(executor.map(submit_refine_job, selected_clips))
+
+    for clip_uri, (job_id, e) in zip(selected_clips, submissions):
+        if e is None:
+            st.session_state.refine_jobs.append({"job_id": job_id, "clip": clip_names[clip_uri], "status": JobStatus.PENDING})
+            st.success(t("backend_job_start_success").format(job_id=job_id))
+        else:
+            st.error(t("face_recognition_job_start_error").format(filename=clip_names[clip_uri], error=e.response.text if e.response else e))
     
     if st.session_state.refine_jobs:
         st.rerun()
 
 # --- Job Status Polling ---
-if "refine_jobs" in st.session_state and st.session_state.refine_jobs:
-    poll_multiple_job_statuses(st.session_state.refine_jobs)
+poll_multiple_job_statuses("refine_jobs")
@@ -1,12 +1,30 @@
 import streamlit as st
 import os
+import pandas as pd
 import requests
 import time
 import datetime
 import re
-from utils import poll_job_status
+import logging
+from utils import poll_job_status, JobStatus, init_session_state, get_signed_urls, render_lazy_video
+from utils import get_gcs_files, clear_gcs_listing_cache, get_api_session, API_TIMEOUT
 from localization import get_translator
 
+_SESSION_DEFAULTS = {
+    "selected_clips_for_joining": [],
+    "join_job_id": None,
+    "join_job_status": None,
+    "join_job_details": "",
+    # Clip names the selection table starts out ticked, and the listing it was built for
+    "clip_join_table_seed": set(),
+    "clip_join_table_listing": (),
+}
+
+def reset_clip_join_table():
+    """Re-seeds the selection table from the current selection and drops its row-index edits."""
+    st.session_state.clip_join_table_seed = {c["name"] for c in st.session_state.selected_clips_for_joining}
+    st.session_state.pop("clip_join_table", None)
+
 def format_duration(seconds):
     """Format duration in seconds to HH:MM:SS format"""
     hours = int(seconds // 3600)
@@ -20,24 +38,6 @@ def calculate_total_duration(selected_clips):
         return 0
     return sum(clip.get('duration', 0) for clip in selected_clips)
 
-def toggle_clip(clip_info):
-    """Callback function to handle checkbox state changes"""
-    clip_name = clip_info['name']
-    # Check the actual checkbox state from session_state
-    checkbox_key = f"select_{clip_name}"
-    is_checked = st.session_state.get(checkbox_key, False)
-    
-    if is_checked:
-        # Add if not already in list
-        if clip_name not in [c['name'] for c in st.session_state.selected_clips_for_joining]:
-            st.session_state.selected_clips_for_joining.append(clip_info)
-    else:
-        # Remove if in list
-        st.session_state.selected_clips_for_joining = [
-            c for c in st.session_state.selected_clips_for_joining 
-            if c['name'] != clip_name
-        ]
-
 def extract_duration_from_blob_name(blob_name):
     """Extract duration from blob name using regex pattern _{clip_duration:.3f}s.mp4"""
     # Pattern to match _{duration}s.mp4 format
@@ -47,39 +47,28 @@ def extract_duration_from_blob_name(blob_name):
         return float(match.group(1))
     return 0.0
 
-# Define the base URL for the backend API
 def list_gcs_clips_for_display(bucket_name, prefix):
     """
     Lists clips and generates signed URLs for direct display in Streamlit.
-    This remains in the UI as it's for presentation, not processing.
+    Both the listing and the signed URLs are cached, so reruns from checkbox
+    toggles don't re-list the folder or re-sign every clip.
     """
-    try:
-        api_url = f"{st.session_state.API_BASE_URL}/gcs/list"
-        params = {"gcs_bucket": bucket_name, "prefix": prefix}
-        response = requests.get(api_url, params=params)
-        response.raise_for_status()
-        blob_names = response.json().get("files", [])
-
-        clips_data = []
-        for blob_name in blob_names:
-            api_url = f"{st.session_state.API_BASE_URL}/gcs/signed-url"
-            params = {"gcs_bucket": bucket_name, "blob_name": blob_name}
-            response = requests.get(api_url, params=params)
-            if response.status_code == 200:
-                url = response.json().get("url")
-                duration = extract_duration_from_blob_name(blob_name)
-                clips_data.append({
-                    "name": blob_name,
-                    "filename": os.path.basename(blob_name),
-                    "url": url,
-                    "duration": duration
-                })
-            else:
-                print(f"Could not generate signed URL for {blob_name}: {response.text}")
-                continue
-        return clips_data, None
-    except requests.exceptions.RequestException as e:
-        return [], f"Error processing GCS clips for display: {e}"
+    blob_names = get_gcs_files(bucket_name, prefix)
+    signed_clips = list(zip(blob_names, get_signed_urls(bucket_name, blob_names)))
+    clips_data = [
+        {
+            "name": blob_name,
+            "filename": os.path.basename(blob_name),
+            "url": url,
+            "duration": extract_duration_from_blob_name(blob_name),
+        }
+        for blob_name, (url, error) in signed_clips
+        if not error
+    ]
+    for blob_name, (_, error) in signed_clips:
+        if error:
+            logging.warning("Could not generate signed URL for %s: %s", blob_name, error)
+    return clips_data
 
 
 # --- Render Video Joining Page ---
@@ -90,14 +79,7 @@ workspace = st.session_state.workspace
 st.info(t("step5_subheader"), icon=":material/info:")
 
 # Initialize session state
-if 'selected_clips_for_joining' not in st.session_state:
-    st.session_state.selected_clips_for_joining = []
-if 'join_job_id' not in st.session_state:
-    st.session_state.join_job_id = None
-if 'join_job_status' not in st.session_state:
-    st.session_state.join_job_status = None
-if 'join_job_details' not in st.session_state:
-    st.session_state.join_job_details = ""
+init_session_state(_SESSION_DEFAULTS)
 
 # --- Source Selection ---
 st.subheader(t("select_clip_source_subheader"))
@@ -121,6 +103,7 @@ def on_source_change():
     display_value = st.session_state.clip_source_selector
     st.session_state.clip_source_key = source_options_display[display_value]
     st.session_state.selected_clips_for_joining = [] # Clear selection on source change
+    reset_clip_join_table()
 
 # We need to find the current display value that corresponds to our stored key
 current_display_value = [k for k, v in source_options_display.items() if v == st.session_state.clip_source_key][0]
@@ -139,10 +122,7 @@ clips_gcs_prefix = source_keys[st.session_state.clip_source_key]
 joined_clips_gcs_prefix = "joined_clips/" # This can remain global or be namespaced too
 
 st.subheader(t("select_clips_to_join_subheader"))
-clips_data, error = list_gcs_clips_for_display(gcs_bucket_name, clips_gcs_prefix)
-if error:
-    st.error(t("display_gcs_clips_error").format(e=error))
-    st.stop()
+clips_data = list_gcs_clips_for_display(gcs_bucket_name, clips_gcs_prefix)
 
 if not clips_data:
     st.info(t("no_clips_in_gcs_info").format(bucket_name=gcs_bucket_name, prefix=clips_gcs_prefix))
@@ -155,17 +135,11 @@ col1, col2, col3 = st.columns(3, gap="large")
 with col1:
     if st.button(t("select_all_button"), key="select_all_clips_joining", use_container_width=True, icon=":material/check_circle:"):
         st.session_state.selected_clips_for_joining = clips_data.copy()
-        # Update all checkbox states
-        for clip in clips_data:
-            st.session_state[f"select_{clip['name']}"] = True
-        st.rerun()
+        reset_clip_join_table()
 with col2:
     if st.button(t("deselect_all_button"), key="deselect_all_clips_joining", use_container_width=True, icon=":material/close:"):
         st.session_state.selected_clips_for_joining = []
-        # Update all checkbox states
-        for clip in clips_data:
-            st.session_state[f"select_{clip['name']}"] = False
-        st.rerun()
+        reset_clip_join_table()
 with col3:
     if st.button(t("delete_selected_button"), key="delete_selected_clips_joining", use_container_width=True, icon=":material/delete:"):
         if st.session_state.selected_clips_for_joining:
@@ -177,7 +151,7 @@ with col3:
                         "gcs_bucket": gcs_bucket_name,
                         "blob_name": clip['name']
                     }
-                    response = requests.delete(api_url, json=payload)
+                    response = get_api_session().delete(api_url, json=payload, timeout=API_TIMEOUT)
                     response.raise_for_status()
                 except requests.exceptions.RequestException as e:
                     errors.append(t("delete_selected_clips_error").format(filename=clip['filename'], e=e))
@@ -187,30 +161,58 @@ with col3:
             else:
                 st.success(t("delete_all_selected_clips_success"))
             
-            # Clear checkbox states for deleted clips before clearing the selection
-            for clip in st.session_state.selected_clips_for_joining:
-                checkbox_key = f"select_{clip['name']}"
-                if checkbox_key in st.session_state:
-                    st.session_state[checkbox_key] = False
-            
             st.session_state.selected_clips_for_joining = []
+            reset_clip_join_table()
+            clear_gcs_listing_cache(gcs_bucket_name, clips_gcs_prefix)
             st.rerun()
 
+# --- Clip Selection Table ---
+# A single data_editor replaces one checkbox widget per clip. The editor records ticks by
+# row index, so it is re-seeded from the selection whenever the listing changes; the seed
+# is not rewritten from the editor's own output, which would re-apply its edits to it.
+listing = tuple(clip["name"] for clip in clips_data)
+if st.session_state.clip_join_table_listing != listing:
+    st.session_state.clip_join_table_listing = listing
+    st.session_state.selected_clips_for_joining = [c for c in st.session_state.selected_clips_for_joining if c["name"] in listing]
+    reset_clip_join_table()
+
+selection_df = pd.DataFrame({
+    "selected": [clip["name"] in st.session_state.clip_join_table_seed for clip in clips_data],
+    "file": [clip["filename"] for clip in clips_data],
+    "duration": [clip["duration"] for clip in clips_data],
+    "name": [clip["name"] for clip in clips_data],
+})
+edited_df = st.data_editor(
+    selection_df,
+    column_config={
+        "selected": st.column_config.CheckboxColumn(t("selected_column")),
+        "file": t("file_column"),
+        "duration": st.column_config.NumberColumn(t("duration_seconds_column"), format="%.1f"),
+        "name": None,
+    },
+    disabled=["file", "duration", "name"],
+    hide_index=True,
+    use_container_width=True,
+    key="clip_join_table",
+)
+# Clips keep the order they were selected in; newly ticked ones are appended
+ticked_names = set(edited_df["name"][edited_df["selected"]])
+still_selected = [c for c in st.session_state.selected_clips_for_joining if c["name"] in ticked_names]
+kept_names = {c["name"] for c in still_selected}
+st.session_state.selected_clips_for_joining = still_selected + [
+    clip for clip in clips_data if clip["name"] in ticked_names and clip["name"] not in kept_names
+]
+
 num_columns = st.slider(t("columns_for_display_slider"), 1, 5, 3)
 cols = st.columns(num_columns)
 
 for i, clip_info in enumerate(clips_data):
     with cols[i % num_columns]:
-        st.video(clip_info["url"])
+        render_lazy_video(clip_info["url"])
 
         c1, c2 = st.columns([0.8, 0.2])
         with c1:
-            st.checkbox(
-                t("select_checkbox").format(filename=clip_info['filename']),
-                key=f"select_{clip_info['name']}",
-                on_change=toggle_clip,
-                args=(clip_info,)
-            )
+            st.caption(clip_info['filename'])
         with c2:
             if st.button(":material/delete:", key=f"delete_clip_{clip_info['name']}", help=t("delete_clip_button_help").format(filename=clip_info['filename'])):
                 try:
@@ -219,15 +221,13 @@ for i, clip_info in enumerate(clips_data):
                         "gcs_bucket": gcs_bucket_name,
                         "blob_name": clip_info['name']
                     }
-                    response = requests.delete(api_url, json=payload)
+                    response = get_api_session().delete(api_url, json=payload, timeout=API_TIMEOUT)
                     response.raise_for_status()
                     # Also remove from selection if it was selected
                     st.session_state.selected_clips_for_joining = [c for c in st.session_state.selected_clips_for_joining if c['name'] != clip_info['name']]
-                    # Update checkbox state
-                    checkbox_key = f"select_{clip_info['name']}"
-                    if checkbox_key in st.session_state:
-                        st.session_state[checkbox_key] = False
+                    reset_clip_join_table()
                     st.success(t("delete_single_clip_success").format(filename=clip_info['filename']))
+                    clear_gcs_listing_cache(gcs_bucket_name, clips_gcs_prefix)
                     st.rerun()
                 except requests.exceptions.RequestException as e:
                     st.error(t("delete_single_clip_error").format(filename=clip_info['filename'], e=e))
@@ -248,17 +248,18 @@ with st.sidebar:
                     "clip_blob_names": [c['name'] for c in st.session_state.selected_clips_for_joining],
                     "output_gcs_prefix": joined_clips_gcs_prefix
                 }
-                response = requests.post(api_url, json=payload)
+                response = get_api_session().post(api_url, json=payload, timeout=API_TIMEOUT)
                 response.raise_for_status()
                 
                 data = response.json()
                 st.session_state.join_job_id = data.get("job_id")
-                st.session_state.join_job_status = "pending"
+                st.session_state.join_job_status = JobStatus.PENDING
                 st.success(t("backend_job_start_success").format(job_id=st.session_state.join_job_id))
 
             except requests.exceptions.RequestException as e:
                 st.error(t("video_joining_job_start_error").format(e=e))
                 st.session_state.join_job_id = None
+                st.session_state.join_job_status = None
         
         # Display total duration
         total_duration_seconds = calculate_total_duration(st.session_state.selected_clips_for_joining)
@@ -273,8 +274,7 @@ with st.sidebar:
         st.info(t("select_clips_to_stitch_info"))
 
 # --- Job Status Polling ---
-if st.session_state.get("join_job_id"):
+if st.session_state.get("join_job_status"):
     st.markdown("---")
     st.subheader(t("processing_status_subheader"))
-    poll_job_status(st.session_state.join_job_id)
-    st.session_state.join_job_id = None
\ No newline at end of file
+    poll_job_status("join")
\ No newline at end of file
@@ -2,43 +2,35 @@ import streamlit as st
 import requests
 import os
 from localization import get_translator
+from utils import get_signed_urls, render_lazy_video, get_gcs_files, clear_gcs_listing_cache
+from utils import get_api_session, API_TIMEOUT
 
-def list_gcs_videos_via_api(bucket_name, prefix):
-    """Lists videos in GCS via the backend API and gets signed URLs."""
-    try:
-        # List files
-        api_url_list = f"{st.session_state.API_BASE_URL}/gcs/list"
-        params_list = {"gcs_bucket": bucket_name, "prefix": prefix}
-        response_list = requests.get(api_url_list, params=params_list)
-        response_list.raise_for_status()
-        blob_names = response_list.json().get("files", [])
+# Joined outputs shown on this page; str.endswith matches the whole tuple in one call
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
 
-        videos = []
-        for blob_name in blob_names:
-            if not blob_name.endswith(('.mp4', '.mov', '.avi')):
-                continue
+def list_gcs_videos_via_api(bucket_name, prefix):
+    """
+    Lists videos in GCS via the backend API and gets signed URLs.
+    The listing is cached, so ticking a checkbox doesn't re-list the folder.
+    """
+    video_blob_names = [name for name in get_gcs_files(bucket_name, prefix) if name.lower().endswith(VIDEO_EXTENSIONS)]
 
-            # Get signed URL for each video
-            api_url_signed = f"{st.session_state.API_BASE_URL}/gcs/signed-url"
-            params_signed = {"gcs_bucket": bucket_name, "blob_name": blob_name}
-            response_signed = requests.get(api_url_signed, params=params_signed)
-            if response_signed.status_code == 200:
-                url = response_signed.json().get("url")
-                videos.append({"blob_name": blob_name, "url": url})
-            else:
-                st.warning(f"Could not get signed URL for {blob_name}")
+    videos = []
+    # Signed URLs for all videos are fetched concurrently
+    for blob_name, (url, error) in zip(video_blob_names, get_signed_urls(bucket_name, video_blob_names)):
+        if not error:
+            videos.append({"blob_name": blob_name, "url": url})
+        else:
+            st.warning(f"Could not get signed URL for {blob_name}")
 
-        return videos
-    except requests.exceptions.RequestException as e:
-        # st.error(f"Error listing GCS videos via API: {e}")
-        return []
+    return videos
 
 def delete_gcs_videos_via_api(bucket_name, blob_names):
     """Deletes videos from GCS via the backend API."""
     try:
         api_url = f"{st.session_state.API_BASE_URL}/gcs/delete-batch"
         payload = {"gcs_bucket": bucket_name, "blob_names": blob_names}
-        response = requests.post(api_url, json=payload)
+        response = get_api_session().post(api_url, json=payload, timeout=API_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -65,14 +57,19 @@ if videos:
             if st.checkbox("", key=f"final_video_{i}"):
                 selected_videos.append(video["blob_name"])
         with col2:
-            st.video(video["url"])
+            render_lazy_video(video["url"])
 
     if selected_videos:
         if st.button(t("delete_selected_button")):
             with st.spinner(t("deleting_videos_spinner")):
                 result = delete_gcs_videos_via_api(gcs_bucket_name, selected_videos)
                 if result:
-                    st.success(t("delete_videos_success"))
+                    clear_gcs_listing_cache(gcs_bucket_name, joined_clips_prefix)
+                    failed_files = result.get("failed_files", {})
+                    for blob_name, error in failed_files.items():
+                        st.error(t("delete_clip_fail").format(filename=os.path.basename(blob_name), error=error))
+                    if not failed_files:
+                        st.success(t("delete_videos_success"))
                 else:
                     st.error(t("delete_videos_error"))
 else:
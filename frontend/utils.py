@@ -1,101 +1,423 @@
 import streamlit as st
 import requests
+import gzip
+import json
 import time
+import hashlib
+import html
+import copy
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-def poll_job_status(job_id: str):
+
+class JobStatus(str, Enum):
+    """Job states reported by the backend's /jobs endpoint (see backend/schemas.py)."""
+    PENDING = "pending"  # Submitted from the UI, not yet polled
+    QUEUED = "queued"
+    SUBMITTED = "submitted"
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    ERROR = "error"  # The status could not be retrieved
+
+
+# (connect, read) timeout in seconds for calls to the backend API
+API_TIMEOUT = (3, 30)
+
+
+@st.cache_resource
+def get_api_session() -> requests.Session:
+    """
+    Returns a process-wide requests.Session for the backend API, so connections
+    are kept alive and reused across reruns and polls instead of reopened per call.
+    Idempotent requests are retried with backoff on transient gateway errors.
     """
-    Polls the backend for the status of a background job and displays it in the UI.
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def post_compressed_json(url: str, payload: dict) -> requests.Response:
+    """
+    POSTs `payload` as gzip-compressed JSON. Used for large request bodies such as
+    prompt templates with long lists of GCS URIs; the backend decompresses them.
+    """
+    body = gzip.compress(json.dumps(payload).encode("utf-8"))
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    return get_api_session().post(url, data=body, headers=headers, timeout=API_TIMEOUT)
+
+
+# Seconds between two status requests for a running job
+JOB_POLL_INTERVAL_SECONDS = 5
+# A single job's status is checked on this tick; while it reports no change the
+# delay between requests grows by JOB_POLL_BACKOFF_FACTOR up to the maximum
+JOB_POLL_MIN_INTERVAL_SECONDS = 2
+JOB_POLL_MAX_INTERVAL_SECONDS = 30
+JOB_POLL_BACKOFF_FACTOR = 1.5
+
+# Statuses for which a job is still worth polling
+ACTIVE_JOB_STATUSES = frozenset({JobStatus.PENDING, JobStatus.QUEUED, JobStatus.SUBMITTED, JobStatus.IN_PROGRESS})
+# Statuses after which a job's status no longer changes
+TERMINAL_JOB_STATUSES = frozenset({JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.ERROR})
+
+
+def _render_completed_status(details, failed_files):
+    if failed_files:
+        # The backend flags partial failures, so there is no need to scan the per-file results here
+        status_box = st.status(f"⚠️ **Job Complete with errors:** {details}", state="error", expanded=True)
+        for filename, reason in failed_files.items():
+            status_box.write(f"**{filename}**: {reason}")
+    else:
+        st.status(f"✅ **Job Complete:** {details}", state="complete")
+
+
+def _render_in_progress_status(details, failed_files):
+    st.status(f"⏳ **In Progress:** {details}", state="running")
+
+
+# Renderer per job status; anything not listed is shown as in progress
+_STATUS_RENDERERS = {
+    JobStatus.COMPLETED: _render_completed_status,
+    JobStatus.FAILED: lambda details, failed_files: st.status(f"❌ **Job Failed:** {details}", state="error"),
+    JobStatus.ERROR: lambda details, failed_files: st.status(details, state="error"),
+}
+
+
+def _render_job_status(status, details, failed_files=None):
+    """Renders a job's status as a single st.status element."""
+    _STATUS_RENDERERS.get(status, _render_in_progress_status)(details, failed_files)
+
+
+@st.fragment(run_every=JOB_POLL_MIN_INTERVAL_SECONDS)
+def _poll_job_status_fragment(job_key: str, output_prefix: str = None):
+    """Polls the backend when the backoff delay has passed; only this fragment reruns while the job is active."""
+    job_id = st.session_state.get(f"{job_key}_job_id")
+    if not job_id:
+        return
+
+    now = time.monotonic()
+    previous = (st.session_state.get(f"{job_key}_job_status"), st.session_state.get(f"{job_key}_job_details"))
+    if now < st.session_state.get(f"{job_key}_next_poll_at", 0):
+        _render_job_status(*previous)
+        return
+
+    job_data = {}
+    try:
+        status_url = f"{st.session_state.API_BASE_URL}/jobs/{job_id}"
+        response = get_api_session().get(status_url, timeout=API_TIMEOUT)
+        response.raise_for_status()
+
+        job_data = response.json()
+        status = job_data.get("status")
+        details = job_data.get("details")
+    except requests.exceptions.RequestException as e:
+        status = JobStatus.ERROR
+        details = f"Could not get job status. Connection error: {e}"
+
+    st.session_state[f"{job_key}_job_status"] = status
+    st.session_state[f"{job_key}_job_details"] = details
+
+    # Poll quickly while the job reports progress and back off while it doesn't
+    interval = st.session_state.get(f"{job_key}_poll_interval", JOB_POLL_MIN_INTERVAL_SECONDS)
+    if (status, details) == previous:
+        interval = min(interval * JOB_POLL_BACKOFF_FACTOR, JOB_POLL_MAX_INTERVAL_SECONDS)
+    else:
+        interval = JOB_POLL_MIN_INTERVAL_SECONDS
+    st.session_state[f"{job_key}_poll_interval"] = interval
+    st.session_state[f"{job_key}_next_poll_at"] = now + interval
+
+    if status in TERMINAL_JOB_STATUSES:
+        # The next job of this kind starts polling without a delay
+        st.session_state.pop(f"{job_key}_poll_interval", None)
+        st.session_state.pop(f"{job_key}_next_poll_at", None)
+        if status == JobStatus.COMPLETED:
+            # Completed jobs write new files to GCS; when the output folder is known,
+            # listings of other folders stay cached
+            clear_gcs_listing_cache(st.session_state.get("GCS_BUCKET_NAME"), output_prefix)
+            # Check for generated files and store them in the session state
+            if "generated_files" in job_data:
+                st.session_state.generated_metadata_files = job_data["generated_files"]
+        st.session_state[f"{job_key}_job_failed_files"] = job_data.get("failed_files", {})
+        # Stop polling and rerun the whole page so it reflects the job's results
+        st.session_state[f"{job_key}_job_id"] = None
+        st.rerun()
+
+    _render_job_status(status, details)
+
+
+def poll_job_status(job_key: str, output_prefix: str = None):
+    """
+    Displays the status of a background job tracked in session state.
+    While the job is running, a fragment re-polls the backend with an
+    exponential backoff between JOB_POLL_MIN_INTERVAL_SECONDS and
+    JOB_POLL_MAX_INTERVAL_SECONDS, without blocking or re-running the page.
 
     Args:
-        job_id: The ID of the job to poll.
+        job_key: Session state prefix of the job, e.g. "metadata" for
+            metadata_job_id, metadata_job_status and metadata_job_details.
+        output_prefix: GCS folder the job writes to. Its cached listing is dropped
+            when the job completes; without it all cached listings are dropped.
     """
-    status_placeholder = st.empty()
+    if st.session_state.get(f"{job_key}_job_id"):
+        _poll_job_status_fragment(job_key, output_prefix)
+    else:
+        _render_job_status(
+            st.session_state.get(f"{job_key}_job_status"),
+            st.session_state.get(f"{job_key}_job_details"),
+            st.session_state.get(f"{job_key}_job_failed_files"),
+        )
+
+def _render_job_list(jobs: list):
+    """Renders one status line per job from the statuses stored on the jobs."""
+    for job in jobs:
+        label = job.get('clip', job['job_id'])
+        details = job.get('details', "No details.")
+        if job['status'] == JobStatus.COMPLETED:
+            st.success(f"✅ **{label}**: {details}")
+        elif job['status'] in (JobStatus.FAILED, JobStatus.ERROR):
+            st.error(f"❌ **{label}**: {details}")
+        else: # in_progress
+            st.info(f"⏳ **{label}**: {details}")
+    if not any(job['status'] in ACTIVE_JOB_STATUSES for job in jobs):
+        st.info("All jobs have finished.")
 
-    while True:
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)
+def _poll_multiple_jobs_fragment(jobs_key: str):
+    """Polls every active job once per run; only this fragment reruns while jobs are active."""
+    jobs = st.session_state.get(jobs_key, [])
+
+    for job in jobs:
+        if job['status'] not in ACTIVE_JOB_STATUSES:
+            continue
         try:
-            status_url = f"{st.session_state.API_BASE_URL}/jobs/{job_id}"
-            response = requests.get(status_url)
+            status_url = f"{st.session_state.API_BASE_URL}/jobs/{job['job_id']}"
+            response = get_api_session().get(status_url, timeout=API_TIMEOUT)
             response.raise_for_status()
 
             job_data = response.json()
-            status = job_data.get("status")
-            details = job_data.get("details")
-
-            if status == "completed":
-                status_placeholder.success(f"✅ **Job Complete:** {details}")
-                # Check for generated files and store them in the session state
-                if "generated_files" in job_data:
-                    st.session_state.generated_metadata_files = job_data["generated_files"]
-                break
-            elif status == "failed":
-                status_placeholder.error(f"❌ **Job Failed:** {details}")
-                break
-            else:
-                status_placeholder.info(f"⏳ **In Progress:** {details}")
-
+            job['status'] = job_data.get("status")
+            job['details'] = job_data.get("details", "No details.")
         except requests.exceptions.RequestException as e:
-            status_placeholder.error(f"Could not get job status. Connection error: {e}")
-            break
-        
-        time.sleep(5) # Poll every 5 seconds
+            job['status'] = JobStatus.ERROR # Stop polling for this job
+            job['details'] = f"Could not get status for job {job['job_id']}. Error: {e}"
+
+    if not any(job['status'] in ACTIVE_JOB_STATUSES for job in jobs):
+        # Stop the timer by rerunning the page, which renders the final statuses statically
+        st.rerun()
+
+    _render_job_list(jobs)
+
 
-def poll_multiple_job_statuses(jobs: list):
+def poll_multiple_job_statuses(jobs_key: str):
     """
-    Polls the backend for the status of multiple background jobs and displays them in the UI.
+    Displays the status of multiple background jobs tracked in session state.
+    While any job is running, a fragment re-polls the backend every
+    JOB_POLL_INTERVAL_SECONDS without blocking or re-running the page.
 
     Args:
-        jobs: A list of job dictionaries, where each dictionary has at least a "job_id" and "status".
+        jobs_key: Session state key of a list of job dictionaries, where each
+            dictionary has at least a "job_id" and "status".
     """
+    jobs = st.session_state.get(jobs_key)
     if not jobs:
         return
 
     st.markdown("---")
     st.subheader("Job Status")
 
-    # Create a copy of the list to iterate over, so we can modify the original
-    jobs_to_poll = list(jobs)
-
-    for job in jobs_to_poll:
-        if job['status'] in ["pending", "in_progress"]:
-            try:
-                status_url = f"{st.session_state.API_BASE_URL}/jobs/{job['job_id']}"
-                response = requests.get(status_url)
-                response.raise_for_status()
-                
-                job_data = response.json()
-                job['status'] = job_data.get("status")
-                details = job_data.get("details", "No details.")
-                
-                if job['status'] == "completed":
-                    st.success(f"✅ **{job.get('clip', job['job_id'])}**: {details}")
-                elif job['status'] == "failed":
-                    st.error(f"❌ **{job.get('clip', job['job_id'])}**: {details}")
-                else: # in_progress
-                    st.info(f"⏳ **{job.get('clip', job['job_id'])}**: {details}")
-
-            except requests.exceptions.RequestException as e:
-                st.error(f"Could not get status for job {job['job_id']}. Error: {e}")
-                job['status'] = "error" # Stop polling for this job
-
-    # Filter out completed/failed jobs from the session state list
-    st.session_state.refine_jobs = [j for j in jobs if j['status'] in ["pending", "in_progress"]]
-
-    # If there are still jobs running, schedule a rerun
-    if st.session_state.refine_jobs:
-        time.sleep(5)
-        st.rerun()
+    if any(job['status'] in ACTIVE_JOB_STATUSES for job in jobs):
+        _poll_multiple_jobs_fragment(jobs_key)
     else:
-        st.info("All jobs have finished.")
+        _render_job_list(jobs)
+
+
+# GCS folder listings are reused across reruns for this many seconds
+GCS_LISTING_TTL_SECONDS = 60
+
+
+@st.cache_data(ttl=GCS_LISTING_TTL_SECONDS, show_spinner=False)
+def _list_gcs_folder(api_base_url, bucket_name, prefix, version):
+    """
+    Calls the backend listing endpoint. Failed requests raise and are not cached.
+    `version` is only part of the cache key; bumping it invalidates one folder.
+    """
+    response = get_api_session().get(
+        f"{api_base_url}/gcs/list",
+        params={"gcs_bucket": bucket_name, "prefix": prefix},
+        timeout=API_TIMEOUT,
+    )
+    # Older backends answer an empty folder with 404; it is cached as an empty listing
+    if response.status_code == 404:
+        return {"files": [], "truncated": False}
+    response.raise_for_status()
+    return response.json()
+
+
+@st.cache_resource
+def _listing_versions() -> dict:
+    """Process-wide listing version per (bucket, prefix), shared like the st.cache_data entries."""
+    return {}
+
+
+def clear_gcs_listing_cache(bucket_name=None, prefix=None):
+    """
+    Drops cached folder listings, e.g. after files were added or deleted.
+    Given a bucket and prefix, only that folder's listing is dropped.
+    """
+    if bucket_name and prefix:
+        versions = _listing_versions()
+        versions[(bucket_name, prefix)] = versions.get((bucket_name, prefix), 0) + 1
+    else:
+        _list_gcs_folder.clear()
+
+
 def get_gcs_files(bucket_name, prefix):
-    """Fetches a list of files from a GCS bucket folder."""
-    api_url = st.session_state.API_BASE_URL
+    """
+    Fetches a list of files from a GCS bucket folder.
+    Listings are cached briefly so widget interactions don't re-list the folder.
+    """
     try:
-        response = requests.get(
-            f"{api_url}/gcs/list",
-            params={"gcs_bucket": bucket_name, "prefix": prefix},
-        )
-        response.raise_for_status()
-        return response.json().get("files", [])
+        version = _listing_versions().get((bucket_name, prefix), 0)
+        data = _list_gcs_folder(st.session_state.API_BASE_URL, bucket_name, prefix, version)
     except requests.exceptions.RequestException as e:
         st.error(f"Failed to fetch files from GCS: {e}")
-        return []
\ No newline at end of file
+        return []
+    if data.get("truncated"):
+        st.warning(f"Only the first {len(data['files'])} files in '{prefix}' are shown.")
+    return data.get("files", [])
+
+
+# Signed URLs are valid for an hour; cached ones are dropped well before they expire
+SIGNED_URL_TTL_SECONDS = 3000
+
+
+@st.cache_data(ttl=SIGNED_URL_TTL_SECONDS, show_spinner=False)
+def _fetch_signed_url(api_base_url, bucket_name, blob_name):
+    """Calls the backend signing endpoint. Failed requests raise and are not cached."""
+    response = get_api_session().get(
+        f"{api_base_url}/gcs/signed-url",
+        params={"gcs_bucket": bucket_name, "blob_name": blob_name},
+        timeout=API_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json().get("url")
+
+
+def get_signed_url(bucket_name, blob_name):
+    """
+    Returns a (signed_url, error) tuple for a GCS blob.
+    URLs are cached so reruns don't re-sign every displayed file.
+    """
+    try:
+        return _fetch_signed_url(st.session_state.API_BASE_URL, bucket_name, blob_name), None
+    except requests.exceptions.RequestException as e:
+        return None, e.response.text if e.response is not None else str(e)
+
+
+# Upper bound on concurrent signing requests sent to the backend
+SIGNED_URL_MAX_WORKERS = 8
+
+
+def get_signed_urls(bucket_name, blob_names):
+    """
+    Returns a list of (signed_url, error) tuples in the order of `blob_names`.
+    Uncached URLs are requested concurrently instead of one after another.
+    """
+    if not blob_names:
+        return []
+    ctx = get_script_run_ctx()
+
+    def _sign(blob_name):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return get_signed_url(bucket_name, blob_name)
+
+    with ThreadPoolExecutor(max_workers=min(SIGNED_URL_MAX_WORKERS, len(blob_names))) as executor:
+        return list(executor.map(_sign, blob_names))
+
+
+# Matches "gs://<bucket>/<blob name>"; compiled once at import
+_GCS_URI_RE = re.compile(r"gs://([^/]+)/(.+)")
+
+
+def parse_gcs_uri(gcs_uri: str):
+    """Splits a gs:// URI into a (bucket_name, blob_name) tuple. Raises ValueError for other strings."""
+    match = _GCS_URI_RE.fullmatch(gcs_uri)
+    if not match:
+        raise ValueError(f"Not a GCS URI: {gcs_uri}")
+    return match.group(1), match.group(2)
+
+
+# Number of columns used when laying out video previews
+VIDEO_GRID_COLUMNS = 4
+
+
+def render_lazy_video(url: str):
+    """
+    Embeds a video player that doesn't fetch anything until it is played.
+    Unlike st.video, preload="none" stops the browser from requesting every
+    clip's metadata from GCS as soon as the page renders.
+    """
+    st.markdown(
+        f'<video src="{html.escape(url)}" preload="none" controls style="width:100%"></video>',
+        unsafe_allow_html=True,
+    )
+
+
+# Metadata tables are serialized to the browser on every rerun, so previews are capped
+PREVIEW_MAX_ROWS = 200
+
+
+def render_dataframe_preview(df, truncated_caption: str):
+    """
+    Renders at most PREVIEW_MAX_ROWS rows of `df`. When rows are left out,
+    `truncated_caption` is shown, formatted with `shown` and `total`.
+    """
+    st.dataframe(df.head(PREVIEW_MAX_ROWS))
+    if len(df) > PREVIEW_MAX_ROWS:
+        st.caption(truncated_caption.format(shown=PREVIEW_MAX_ROWS, total=len(df)))
+
+
+def uri_widget_key(prefix: str, uri: str) -> str:
+    """Returns a short, stable widget key for a GCS URI instead of embedding the full URI."""
+    return f"{prefix}_{hashlib.blake2b(uri.encode(), digest_size=8).hexdigest()}"
+
+
+def sync_uri_selection(selection_key: str, checkbox_prefix: str, uris: list) -> dict:
+    """
+    Brings the {uri: selected} dict stored under `selection_key` in line with a new listing
+    and returns it. The dict is updated in place: only new URIs are added and only removed
+    ones are dropped, along with the `checkbox_prefix` widget states of removed URIs.
+    """
+    selection = st.session_state.setdefault(selection_key, {})
+    for uri in uris:
+        selection.setdefault(uri, False)
+    if len(selection) > len(uris):
+        current_uris = set(uris)
+        for uri in [uri for uri in selection if uri not in current_uris]:
+            del selection[uri]
+
+    current_checkbox_keys = {uri_widget_key(checkbox_prefix, uri) for uri in uris}
+    for key in list(st.session_state.keys()):
+        if key.startswith(f"{checkbox_prefix}_") and key not in current_checkbox_keys:
+            del st.session_state[key]
+    return selection
+
+
+def init_session_state(defaults: dict):
+    """
+    Sets every key in `defaults` that is missing from session state.
+    Each page keeps its defaults in a module-level _SESSION_DEFAULTS table and calls this
+    on every rerun, so keys dropped by Streamlit are restored without touching set ones.
+    """
+    for key, default in defaults.items():
+        # Copy mutable defaults so sessions never share the same list/dict object
+        st.session_state.setdefault(key, copy.copy(default))